@@ -1,12 +1,11 @@
 import datetime
-import os
 from collections import OrderedDict
 from contextlib import contextmanager
 from dataclasses import field
-from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Union
 
 from pheasant.core.base import Base
-from pheasant.core.page import Page
+from pheasant.core.page import Page, PageStore, file_digest
 from pheasant.core.parser import Parser
 from pheasant.core.renderer import Renderer
 from pheasant.utils.time import format_timedelta_human
@@ -21,7 +20,7 @@ class Converter(Base):
     renderers: Dict[str, List[Renderer]] = field(default_factory=dict)
     preprocesses: Dict[str, Callable[[str], str]] = field(default_factory=dict)
     postprocesses: Dict[str, Callable[[str], str]] = field(default_factory=dict)
-    pages: Dict[str, Page] = field(default_factory=dict)
+    pages: PageStore = field(default_factory=PageStore)
     dirty: bool = True
     log: Log = field(default_factory=Log, init=False)
 
@@ -91,13 +90,13 @@ class Converter(Base):
         if postprocess:
             self.postprocesses[name] = postprocess
 
-    def parse(self, source: str, name: str = "default") -> str:
+    def parse(self, source: Union[str, Iterable[str]], name: str = "default") -> str:
         """Parse a source text.
 
         Parameters
         ----------
         source
-            The source text to be parsed.
+            The source text to be parsed, or its consecutive parts.
         name
             Parser name to be used.
 
@@ -107,7 +106,9 @@ class Converter(Base):
         """
         return self.parsers[name].parse(source)
 
-    def convert_by_name(self, path: str, name: str) -> str:
+    def convert_by_name(
+        self, path: str, name: str, source: Optional[Iterable[str]] = None
+    ) -> str:
         """Convert a source file with a named parser.
 
         Parameters
@@ -116,24 +117,20 @@ class Converter(Base):
             The source path to be converted.
         name
             Parser name to be used.
+        source
+            Outputs streamed from another parser to be parsed instead of the page
+            source. They are not preprocessed.
 
         Returns
         -------
         Converted output text.
         """
-        if path not in self.pages:
-            self.pages[path] = Page(path)
-            self.pages[path].read()
-
-        page = self.pages[path]
+        page = self._enter(path, name)
 
-        for renderer in self.renderers[name]:
-            renderer.page = page
-            renderer.enter()
-
-        source = page.source
-        if name in self.preprocesses:
-            source = self.preprocesses[name](source)
+        if source is None:
+            source = page.source
+            if name in self.preprocesses:
+                source = self.preprocesses[name](source)
         source = self.parse(source, name)
         if name in self.postprocesses:
             source = self.postprocesses[name](source)
@@ -144,6 +141,52 @@ class Converter(Base):
 
         return page.source
 
+    def stream_by_name(self, path: str, name: str) -> Iterator[str]:
+        """Convert a source file with a named parser and yield the output of cells.
+
+        Unlike `convert_by_name`, the page source is not replaced, so that another
+        parser can parse the outputs before the page has been converted entirely.
+        The renderers exit after the last output.
+
+        Parameters
+        ----------
+        path
+            The source path to be converted.
+        name
+            Parser name to be used. Its postprocess must not be registered.
+
+        Returns
+        -------
+        Iterator of the outputs of cells.
+        """
+        if name in self.postprocesses:
+            raise ValueError(f"Parser '{name}' with a postprocess cannot stream.")
+        page = self._enter(path, name)
+
+        source = page.source
+        if name in self.preprocesses:
+            source = self.preprocesses[name](source)
+
+        def iterator():
+            yield from self.parsers[name].iterparse(source)
+            for renderer in self.renderers[name]:
+                renderer.exit()
+
+        return iterator()
+
+    def _enter(self, path: str, name: str) -> Page:
+        if path not in self.pages:
+            self.pages[path] = Page(path)
+            self.pages[path].read()
+
+        page = self.pages[path]
+
+        for renderer in self.renderers[name]:
+            renderer.page = page
+            renderer.enter()
+
+        return page
+
     def _convert(self, path: str) -> str:
         """Convert a source file with sequntial parsers.
 
@@ -158,6 +201,19 @@ class Converter(Base):
         """
         return self.convert_by_name(path, "default")
 
+    def outdated(self, path: str) -> bool:
+        """Return True if a source file has to be converted again.
+
+        In dirty mode, a converted page is outdated if the content of the file or
+        the files it depends on has changed since the conversion.
+        """
+        if not self.dirty or path not in self.pages:
+            return True
+        page = self.pages.peek(path)
+        if page.digest != file_digest(path):
+            return True
+        return bool(page.changed_dependencies())
+
     def convert(self, path: str) -> str:
         """Convert a source file with sequntial parsers.
 
@@ -170,15 +226,12 @@ class Converter(Base):
         -------
         Converted output text.
         """
-        if self.dirty and path in self.pages:
-            if self.pages[path].st_mtime == os.stat(path).st_mtime:
-                return self.pages[path].source
-            else:
-                self.pages.pop(path)
+        if not self.outdated(path):
+            return self.pages[path].source
+        if self.dirty:
+            self.pages.pop(path, None)
 
-        output = self._convert(path)
-        self.pages[path].st_mtime = os.stat(path).st_mtime
-        return output
+        return self._convert(path)
 
     def _convert_from_files(self, paths: Iterable[str]) -> List[str]:
         return ["Not implemented" for path in paths]
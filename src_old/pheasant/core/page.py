@@ -1,17 +1,140 @@
+import hashlib
 import io
+import json
 import os
-import pickle
+import shutil
+import sqlite3
+import time
+from collections import OrderedDict
+from collections.abc import MutableMapping
+from contextlib import contextmanager
 from dataclasses import dataclass, field
-from typing import Any, Dict, List
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Set, Tuple
+
+CACHE_DIRECTORY = ".pheasant_cache"
+ASSET_DIRECTORY = "assets"
+SPILL_DIRECTORY = "spill"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS page (
+    name TEXT PRIMARY KEY,
+    extra_html TEXT NOT NULL,
+    saved REAL NOT NULL,
+    digest TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS cell (
+    name TEXT NOT NULL,
+    position INTEGER NOT NULL,
+    key TEXT NOT NULL,
+    data TEXT NOT NULL,
+    PRIMARY KEY (name, position)
+);
+CREATE TABLE IF NOT EXISTS output (
+    name TEXT NOT NULL,
+    key TEXT NOT NULL,
+    output TEXT NOT NULL,
+    PRIMARY KEY (name, key)
+);
+CREATE TABLE IF NOT EXISTS result (
+    name TEXT NOT NULL,
+    key TEXT NOT NULL,
+    result TEXT NOT NULL,
+    PRIMARY KEY (name, key)
+);
+CREATE TABLE IF NOT EXISTS tag (
+    name TEXT NOT NULL,
+    tag TEXT NOT NULL,
+    version TEXT NOT NULL,
+    context TEXT NOT NULL,
+    PRIMARY KEY (name, tag)
+);
+CREATE TABLE IF NOT EXISTS dependency (
+    name TEXT NOT NULL,
+    kind TEXT NOT NULL,
+    target TEXT NOT NULL,
+    digest TEXT NOT NULL,
+    PRIMARY KEY (name, kind, target)
+);
+CREATE TABLE IF NOT EXISTS conversion (
+    name TEXT PRIMARY KEY,
+    digest TEXT NOT NULL,
+    fingerprint TEXT NOT NULL,
+    data TEXT NOT NULL
+);
+"""
+
+TABLES = ["page", "cell", "output", "result", "tag", "dependency", "conversion"]
+
+# Version of the schema above. A database of another version is created again.
+SCHEMA_VERSION = 3
+
+# Version of the schema of raw results. Results of other versions are ignored.
+RESULT_VERSION = 1
+
+# Kinds of dependencies whose targets are files with content digests.
+FILE_KINDS = ("file", "module")
+
+# Path -> ((st_mtime_ns, st_size), digest) of files digested in this process.
+DIGESTS: Dict[str, Tuple[Tuple[int, int], str]] = {}
+
+
+def file_digest(path: str) -> str:
+    """Return the SHA1 digest of a file, or "" if it does not exist.
+
+    The file is read again only if its modification time or size has changed
+    since the last call, so that an unchanged file is digested once in a
+    process. Timestamps are never compared with saved ones, which a checkout
+    or a `touch` changes without changing the content.
+    """
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return ""
+    stamp = (stat.st_mtime_ns, stat.st_size)
+    if path in DIGESTS and DIGESTS[path][0] == stamp:
+        return DIGESTS[path][1]
+    with open(path, "rb") as file:
+        digest = hashlib.sha1(file.read()).hexdigest()
+    DIGESTS[path] = (stamp, digest)
+    return digest
 
 
 def cache_path(path: str) -> str:
-    directory, path = os.path.split(path)
-    return os.path.join(directory, ".pheasant_cache", path + ".cache")
+    """Return the path of the cache database for a page."""
+    directory = os.path.dirname(path)
+    return os.path.join(directory, CACHE_DIRECTORY, "cache.db")
+
+
+def migrate(connection: sqlite3.Connection) -> None:
+    """Create the tables of the current schema, dropping those of another version.
+
+    Caches are only for speed, so that they are discarded instead of converted.
+    """
+    connection.execute("BEGIN IMMEDIATE")  # Another process may be migrating.
+    try:
+        version = connection.execute("PRAGMA user_version").fetchone()[0]
+        if version != SCHEMA_VERSION:
+            sql = "SELECT name FROM sqlite_master WHERE type='table'"
+            for (table,) in connection.execute(sql).fetchall():
+                connection.execute(f"DROP TABLE {table}")
+            for statement in SCHEMA.split(";"):
+                connection.execute(statement)
+            connection.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+    except BaseException:
+        connection.rollback()
+        raise
+    connection.commit()
 
 
 @dataclass
 class Cache:
+    """Cache of a page stored in a SQLite database shared in a directory.
+
+    A cell is saved as a metadata row, an output row of rendered HTML and a result
+    row of raw kernel outputs. Outputs and results are keyed by cell keys so that
+    unchanged ones are neither rewritten nor read until needed.
+    """
+
     page_path: str = field(default="", init=False)
 
     @property
@@ -19,57 +142,318 @@ class Cache:
         return cache_path(self.page_path)
 
     @property
-    def size(self) -> float:
-        if os.path.exists(self.path):
-            return os.path.getsize(self.path)
-        else:
-            return 0.0
+    def name(self) -> str:
+        return os.path.basename(self.page_path)
+
+    @property
+    def location(self) -> str:
+        return f"{self.path}:{self.name}"
 
-    def save(self, obj: Any) -> str:
+    @contextmanager
+    def connect(self) -> Iterator[sqlite3.Connection]:
+        """Connect to the database and commit all changes at once on exit."""
         directory = os.path.dirname(self.path)
         if not os.path.exists(directory):
-            os.mkdir(directory)
-        with open(self.path, "wb") as f:
-            pickle.dump(obj, f)
+            os.makedirs(directory, exist_ok=True)
+        connection = sqlite3.connect(self.path, timeout=30)
+        try:
+            version = connection.execute("PRAGMA user_version").fetchone()[0]
+            if version != SCHEMA_VERSION:
+                migrate(connection)
+            with connection:
+                yield connection
+        finally:
+            connection.close()
+
+    def query(self, sql: str, *args) -> Optional[tuple]:
+        if not os.path.exists(self.path):
+            return None
+        with self.connect() as connection:
+            return connection.execute(sql, (self.name,) + args).fetchone()
+
+    @property
+    def exists(self) -> bool:
+        return self.query("SELECT 1 FROM page WHERE name=?") is not None
+
+    @property
+    def saved(self) -> float:
+        row = self.query("SELECT saved FROM page WHERE name=?")
+        return row[0] if row else 0.0
+
+    @property
+    def digest(self) -> Optional[str]:
+        """Digest of the page source which the cache was saved for."""
+        row = self.query("SELECT digest FROM page WHERE name=?")
+        return row[0] if row else None
+
+    @property
+    def size(self) -> float:
+        sql = "SELECT SUM(LENGTH(CAST(output AS BLOB))) FROM output WHERE name=?"
+        row = self.query(sql)
+        return float(row[0] or 0) if row else 0.0
+
+    def save(
+        self, cells: List[Dict[str, Any]], extra_html: str, digest: str = ""
+    ) -> str:
+        """Save cells of a page in a transaction.
+
+        Parameters
+        ----------
+        cells
+            List of dictionaries with 'key' and 'data' items. 'data' is a JSON
+            serializable dictionary. An 'output' item and a 'result' item are
+            saved if exist, otherwise the ones saved before for the key are kept.
+        extra_html
+            Extra HTML for the page.
+        digest
+            Digest of the page source the cells come from. The current digest
+            of the page file if empty.
+
+        Returns
+        -------
+        The path of the database.
+        """
+        name = self.name
+        rows = [
+            (name, position, cell["key"], json.dumps(cell["data"]))
+            for position, cell in enumerate(cells)
+        ]
+        outputs = [
+            (name, cell["key"], cell["output"]) for cell in cells if "output" in cell
+        ]
+        results = []
+        for cell in cells:
+            if cell.get("result"):
+                result = dict(cell["result"], version=RESULT_VERSION)
+                results.append((name, cell["key"], json.dumps(result)))
+        with self.connect() as connection:
+            connection.execute("DELETE FROM cell WHERE name=?", (name,))
+            connection.executemany("INSERT INTO cell VALUES (?, ?, ?, ?)", rows)
+            sql = "INSERT OR REPLACE INTO output VALUES (?, ?, ?)"
+            connection.executemany(sql, outputs)
+            sql = "INSERT OR REPLACE INTO result VALUES (?, ?, ?)"
+            connection.executemany(sql, results)
+            for table in ["output", "result"]:
+                connection.execute(
+                    f"DELETE FROM {table} WHERE name=? AND key NOT IN "
+                    "(SELECT key FROM cell WHERE name=?)",
+                    (name, name),
+                )
+            connection.execute(
+                "INSERT OR REPLACE INTO page VALUES (?, ?, ?, ?)",
+                (name, extra_html, time.time(), digest or file_digest(self.page_path)),
+            )
         return self.path
 
-    def load(self) -> Any:
-        if os.path.exists(self.path):
-            with open(self.path, "rb") as f:
-                return pickle.load(f)
-        return None
+    def load(self) -> Optional[Tuple[List[Dict[str, Any]], str]]:
+        """Load cells of a page without outputs. Use `load_output` to get them."""
+        if not self.exists:
+            return None
+        with self.connect() as connection:
+            sql = "SELECT extra_html FROM page WHERE name=?"
+            extra_html = connection.execute(sql, (self.name,)).fetchone()[0]
+            sql = "SELECT key, data FROM cell WHERE name=? ORDER BY position"
+            rows = connection.execute(sql, (self.name,)).fetchall()
+        cells = [{"key": key, "data": json.loads(data)} for key, data in rows]
+        return cells, extra_html
+
+    def load_output(self, key: str) -> str:
+        row = self.query("SELECT output FROM output WHERE name=? AND key=?", key)
+        return row[0] if row else ""
+
+    def load_result(self, key: str) -> Optional[Dict[str, Any]]:
+        """Load raw outputs of a cell with 'kernel_name', 'outputs' and 'report'."""
+        row = self.query("SELECT result FROM result WHERE name=? AND key=?", key)
+        if not row:
+            return None
+        result = json.loads(row[0])
+        if result.pop("version", None) != RESULT_VERSION:
+            return None
+        return result
+
+    def save_dependencies(self, dependencies: Dict[str, Dict[str, str]]) -> None:
+        """Replace the dependencies of a page.
+
+        Parameters
+        ----------
+        dependencies
+            Dictionary of kind ('file', 'module' or 'tag') to a dictionary of
+            target to its content digest when the page depended on it.
+        """
+        name = self.name
+        rows = [
+            (name, kind, target, digest)
+            for kind, targets in dependencies.items()
+            for target, digest in targets.items()
+        ]
+        with self.connect() as connection:
+            connection.execute("DELETE FROM dependency WHERE name=?", (name,))
+            sql = "INSERT INTO dependency VALUES (?, ?, ?, ?)"
+            connection.executemany(sql, rows)
+
+    def load_dependencies(self) -> Dict[str, Dict[str, str]]:
+        if not os.path.exists(self.path):
+            return {}
+        with self.connect() as connection:
+            sql = "SELECT kind, target, digest FROM dependency WHERE name=?"
+            rows = connection.execute(sql, (self.name,)).fetchall()
+        dependencies: Dict[str, Dict[str, str]] = {}
+        for kind, target, digest in rows:
+            dependencies.setdefault(kind, {})[target] = digest
+        return dependencies
+
+    def save_tags(self, tags: Dict[str, Tuple[str, Dict[str, Any]]]) -> None:
+        """Replace the tags defined in a page.
+
+        Parameters
+        ----------
+        tags
+            Dictionary of tag to a tuple of (version, context).
+        """
+        name = self.name
+        rows = [
+            (name, tag, version, json.dumps(context))
+            for tag, (version, context) in tags.items()
+        ]
+        with self.connect() as connection:
+            connection.execute("DELETE FROM tag WHERE name=?", (name,))
+            connection.executemany("INSERT INTO tag VALUES (?, ?, ?, ?)", rows)
+
+    def load_tags(self) -> Dict[str, Tuple[str, Dict[str, Any]]]:
+        if not os.path.exists(self.path):
+            return {}
+        with self.connect() as connection:
+            sql = "SELECT tag, version, context FROM tag WHERE name=?"
+            rows = connection.execute(sql, (self.name,)).fetchall()
+        return {tag: (version, json.loads(context)) for tag, version, context in rows}
+
+    def save_conversion(
+        self, digest: str, fingerprint: str, source: str, meta: Dict[str, Any]
+    ) -> None:
+        """Save the converted source of a page.
+
+        Parameters
+        ----------
+        digest
+            Digest of the page source which was converted.
+        fingerprint
+            Digest of the version and the configuration of the converter.
+        source
+            Converted source.
+        meta
+            JSON serializable meta data of the page such as 'extra_html'.
+        """
+        data = json.dumps(dict(source=source, meta=meta))
+        with self.connect() as connection:
+            sql = "INSERT OR REPLACE INTO conversion VALUES (?, ?, ?, ?)"
+            connection.execute(sql, (self.name, digest, fingerprint, data))
+
+    def load_conversion(self) -> Optional[Dict[str, Any]]:
+        """Load a converted page with 'digest', 'fingerprint', 'source' and 'meta'."""
+        sql = "SELECT digest, fingerprint, data FROM conversion WHERE name=?"
+        row = self.query(sql)
+        if not row:
+            return None
+        return dict(json.loads(row[2]), digest=row[0], fingerprint=row[1])
 
     def delete(self) -> None:
         if os.path.exists(self.path):
-            os.remove(self.path)
+            with self.connect() as connection:
+                for table in TABLES:
+                    sql = f"DELETE FROM {table} WHERE name=?"
+                    connection.execute(sql, (self.name,))
+        if os.path.exists(self.checkpoint_directory):
+            shutil.rmtree(self.checkpoint_directory)
+
+    @property
+    def asset_directory(self) -> str:
+        """Directory of image files shared by pages in a directory."""
+        return os.path.join(os.path.dirname(self.path), ASSET_DIRECTORY)
+
+    @property
+    def spill_directory(self) -> str:
+        """Directory of outputs truncated by the output budget of cells."""
+        return os.path.join(os.path.dirname(self.path), SPILL_DIRECTORY)
+
+    @property
+    def checkpoint_directory(self) -> str:
+        directory = os.path.dirname(self.path)
+        return os.path.join(directory, self.name + ".checkpoints")
+
+    def checkpoint_path(self, key: str) -> str:
+        return os.path.join(self.checkpoint_directory, key)
+
+    def prune_checkpoints(self, keys: Iterable[str]) -> None:
+        """Delete checkpoints except for the given cell keys."""
+        if not os.path.exists(self.checkpoint_directory):
+            return
+        keys = set(keys)
+        for key in os.listdir(self.checkpoint_directory):
+            if key not in keys:
+                os.remove(self.checkpoint_path(key))
 
 
 @dataclass
 class Page:
     path: str = ""
     source: str = field(default="", init=False)
-    st_mtime: float = field(default=0.0, init=False)
+    digest: str = field(default="", init=False)
     meta: Dict[str, Any] = field(default_factory=dict, init=False)
     cache: Cache = field(default_factory=Cache, init=False)
+    dependencies: Dict[str, Dict[str, str]] = field(default_factory=dict, init=False)
 
     def __post_init__(self):
         self.cache.page_path = self.path
 
     def read(self) -> str:
-        with io.open(self.path, "r", encoding="utf-8-sig", errors="strict") as f:
-            self.source = f.read()
+        with io.open(self.path, "rb") as f:
+            data = f.read()
+        self.digest = hashlib.sha1(data).hexdigest()
+        text = io.TextIOWrapper(io.BytesIO(data), encoding="utf-8-sig", errors="strict")
+        self.source = text.read()
         return self.source
 
     @property
     def has_cache(self) -> bool:
-        return os.path.exists(self.cache.path)
+        return self.cache.exists
 
     @property
     def modified(self) -> bool:
-        if not self.has_cache:
+        digest = self.cache.digest
+        if digest is None:
+            return True
+        elif file_digest(self.path) != digest:
             return True
         else:
-            return os.stat(self.path).st_mtime > os.stat(self.cache.path).st_mtime
+            return bool(self.changed_dependencies())
+
+    def depend(self, kind: str, target: str) -> None:
+        """Record that the page depends on a target.
+
+        Parameters
+        ----------
+        kind
+            'file' for an embedded file, 'module' for a module file imported by
+            the kernel, or 'tag' for a referenced tag.
+        target
+            Absolute path of the file, or the tag.
+        """
+        digest = file_digest(target) if kind in FILE_KINDS else ""
+        self.dependencies.setdefault(kind, {})[target] = digest
+
+    def save_dependencies(self) -> None:
+        if self.dependencies or os.path.exists(self.cache.path):
+            self.cache.save_dependencies(self.dependencies)
+
+    def changed_dependencies(self, kinds: Iterable[str] = FILE_KINDS) -> Set[str]:
+        """Return saved dependencies of the kinds changed after the page depended."""
+        dependencies = self.cache.load_dependencies()
+        return {
+            target
+            for kind in kinds
+            for target, digest in dependencies.get(kind, {}).items()
+            if file_digest(target) != digest
+        }
 
     def to_dict(self) -> Dict[str, Any]:
         return dict(
@@ -80,6 +464,91 @@ class Page:
         )
 
 
+@dataclass
+class PageStore(MutableMapping):
+    """Converted pages by path which keep a bounded number of sources in memory.
+
+    A page marked by `mark_saved` has its converted source and meta in its cache.
+    Such a page releases them when it is the least recently used of more than
+    `size` pages in memory, or when `release` is called, and loads them again
+    from the cache when it is accessed. A size of 0 keeps every page in memory.
+    """
+
+    size: int = 0
+    _pages: Dict[str, Page] = field(default_factory=dict, init=False)
+    _loaded: "OrderedDict[str, None]" = field(default_factory=OrderedDict, init=False)
+    _saved: Set[str] = field(default_factory=set, init=False)
+
+    def __getitem__(self, path: str) -> Page:
+        page = self._pages[path]
+        if path not in self._loaded:
+            conversion = page.cache.load_conversion()
+            if not conversion:  # The cache has been deleted.
+                del self[path]
+                raise KeyError(path)
+            page.source, page.meta = conversion["source"], conversion["meta"]
+            self._loaded[path] = None
+        self._loaded.move_to_end(path)
+        self.evict()
+        return page
+
+    def __setitem__(self, path: str, page: Page) -> None:
+        self._pages[path] = page
+        self._loaded[path] = None
+        self._loaded.move_to_end(path)
+        self._saved.discard(path)
+        self.evict()
+
+    def __delitem__(self, path: str) -> None:
+        del self._pages[path]
+        self._loaded.pop(path, None)
+        self._saved.discard(path)
+
+    def __contains__(self, path) -> bool:
+        return path in self._pages
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self._pages)
+
+    def __len__(self) -> int:
+        return len(self._pages)
+
+    def pop(self, path: str, *default):
+        """Remove a page without loading its source and return it."""
+        self._loaded.pop(path, None)
+        self._saved.discard(path)
+        return self._pages.pop(path, *default)
+
+    def clear(self) -> None:
+        self._pages.clear()
+        self._loaded.clear()
+        self._saved.clear()
+
+    def peek(self, path: str) -> Page:
+        """Return a page without loading its source nor marking it as used."""
+        return self._pages[path]
+
+    def mark_saved(self, path: str) -> None:
+        """Mark that the converted source and meta of a page are in its cache."""
+        self._saved.add(path)
+        self.evict()
+
+    def release(self, path: str) -> None:
+        """Release the source and meta of a saved page if the size is bounded."""
+        if self.size and path in self._saved and path in self._loaded:
+            page = self._pages[path]
+            page.source, page.meta = "", {}
+            del self._loaded[path]
+
+    def evict(self) -> None:
+        if not self.size:
+            return
+        for path in list(self._loaded)[:-1]:  # The last one is being used.
+            if len(self._loaded) <= self.size:
+                break
+            self.release(path)
+
+
 @dataclass
 class Pages:
     paths: List[str]
@@ -1,12 +1,16 @@
+import functools
 import re
 from collections import OrderedDict
 from dataclasses import field
-from typing import Any, Callable, Dict, List, Match, Optional, Pattern, Union
+from typing import (Any, Callable, Dict, Iterable, Iterator, List, Match,
+                    Optional, Pattern, Tuple, Union)
 
 from pheasant.core.base import (Base, Cell, Render, Splitter, get_render_name,
                                 make_cell_class, rename_pattern)
 from pheasant.core.decorator import Decorator
 
+MAX_DEPTH = 256
+
 
 class Parser(Base):
     patterns: Dict[str, str] = field(default_factory=dict, init=False)
@@ -14,6 +18,7 @@ class Parser(Base):
     cell_classes: Dict[str, type] = field(default_factory=dict, init=False)
     pattern: Optional[Pattern] = field(default=None, init=False)
     decorator: Optional[Decorator] = field(default=None, init=False)
+    scanned: Optional[Tuple[str, List[Match]]] = field(default=None, init=False)
 
     def __post_repr__(self):
         return len(self.patterns)
@@ -27,15 +32,18 @@ class Parser(Base):
         self.renders[render_name] = render
         self.patterns[render_name] = pattern
         self.pattern = None  # Delete the pattern compiled before.
+        self.scanned = None
         return cell_class
 
-    def parse(self, source: str, decorate: Union[Callable, bool] = True) -> str:
+    def parse(
+        self, source: Union[str, Iterable[str]], decorate: Union[Callable, bool] = True
+    ) -> str:
         """Parse the source and deligate the process to a render function.
 
         Parameters
         ----------
         source
-            Source text
+            Source text, or consecutive parts of it which are split one by one.
         decorate
             If True, parser's decorator is used to decorate the cell with output
             from the renders. If callable, `decorate` directly decorates the cell.
@@ -45,21 +53,31 @@ class Parser(Base):
         str
             Rendered and decorated output text.
         """
-        splitter = self.split(source)
+        return "".join(self.iterparse(source, decorate))
 
-        def iterator():
-            for cell in splitter:
-                if cell.match:
-                    cell.output = cell.parse(splitter, self)
-                else:
-                    cell.output = cell.source
-                if callable(decorate):
-                    decorate(cell)
-                elif decorate is True and self.decorator:
-                    self.decorator.decorate(cell)
-                yield cell.output
+    def iterparse(
+        self, source: Union[str, Iterable[str]], decorate: Union[Callable, bool] = True
+    ) -> Iterator[str]:
+        """Parse the source and yield the output of each cell as it is rendered.
 
-        return "".join(iterator())
+        See `parse` for the parameters. The output of a cell is yielded piece by
+        piece as its render function yields it unless the cell is decorated.
+        """
+        decorated = callable(decorate) or (decorate is True and self.decorator)
+        splitter = self.split(source)
+        for cell in splitter:
+            if cell.match and not decorated:
+                yield from cell.render(splitter, self)
+                continue
+            if cell.match:
+                cell.output = cell.parse(splitter, self)
+            else:
+                cell.output = cell.source
+            if callable(decorate):
+                decorate(cell)
+            elif decorate is True and self.decorator:
+                self.decorator.decorate(cell)
+            yield cell.output
 
     def parse_from_cell(self, cell: Any, splitter: Splitter, decorate=True) -> str:
         cell.output = cell.parse(splitter, self)
@@ -68,36 +86,69 @@ class Parser(Base):
         return cell.output
 
     def compile(self):
-        self.pattern = re.compile(
-            "|".join(self.patterns.values()), re.MULTILINE | re.DOTALL
-        )
+        self.pattern = compile_pattern("|".join(self.patterns.values()))
 
-    def split(self, source: str) -> Splitter:
-        """Split the source into a cell and yield it.
+    def scan(self, source: str) -> List[Match]:
+        """Return all matches in the source.
 
-        This function returns a Splitter generator. This generator can receive a
-        source through `send` method to return the source you get from generator.
+        The result for the last source is memorized, so that counting cells before
+        parsing and parsing itself scan a page only once.
         """
+        if self.scanned and (self.scanned[0] is source or self.scanned[0] == source):
+            return self.scanned[1]
         if not self.pattern:
             self.compile()
+        matches = list(self.pattern.finditer(source))  # type: ignore
+        self.scanned = (source, matches)
+        return matches
+
+    def count(self, source: str, render_names: Iterable[str]) -> int:
+        """Return the number of cells in the source for the render names."""
+        render_names = set(render_names)
+        # The outermost group named by the render name is the last matched group.
+        return sum(match.lastgroup in render_names for match in self.scan(source))
 
-        def resplit(rework: Optional[str]) -> Splitter:
-            if rework is not None:
-                yield  # Yields None as a return value for send method.
-                yield from self.split(rework)  # Then, yields the same source again.
-
-        cursor = 0
-        for match in self.pattern.finditer(source):  # type: ignore
-            start, end = match.start(), match.end()
-            if cursor < start:
-                rework = yield Cell(source[cursor:start], None, "")
-                yield from resplit(rework)
-            rework = yield self.resolve(match)
-            yield from resplit(rework)
-            cursor = end
-        if cursor < len(source):
-            rework = yield Cell(source[cursor:], None, "")
-            yield from resplit(rework)
+    def split(self, source: Union[str, Iterable[str]]) -> Splitter:
+        """Split the source into a cell and yield it.
+
+        This function returns a Splitter generator. This generator can receive a
+        source through `send` method to return the source you get from generator.
+
+        Sent sources are split before the rest of the current source on an explicit
+        stack of frames instead of nested generators. A frame that has no cell left
+        is dropped before a new one is pushed, so that sources sent at the end of
+        a sent source do not deepen the stack.
+
+        If the source is given in parts, each part is taken when the parts before
+        have been split, so that the parts can be produced while being split. A
+        match cannot span parts.
+        """
+        for source in [source] if isinstance(source, str) else source:
+            stack: List[List[Any]] = [[source, self.scan(source), 0, 0]]
+            while stack:
+                frame = stack[-1]
+                source, matches, index, cursor = frame
+                if index < len(matches) and cursor == matches[index].start():
+                    match = matches[index]
+                    cell = self.resolve(match)
+                    frame[2], frame[3] = index + 1, match.end()
+                elif cursor < len(source):
+                    end = len(source)
+                    if index < len(matches):
+                        end = matches[index].start()
+                    cell = Cell(source[cursor:end], None, "")
+                    frame[3] = end
+                else:
+                    stack.pop()
+                    continue
+                rework = yield cell
+                if rework is not None:
+                    yield  # Yields None as a return value for send method.
+                    if frame[2] == len(matches) and frame[3] == len(source):
+                        stack.pop()
+                    if len(stack) >= MAX_DEPTH:
+                        raise RecursionError("Too deeply nested sources to split.")
+                    stack.append([rework, self.scan(rework), 0, 0])
 
     def resolve(self, match: Match[str]) -> Any:  # Acually, Any is Cell-based instance.
         """Resolve a Match object and return a dataclass instance called `cell`.
@@ -139,3 +190,9 @@ class Parser(Base):
             self.compile()
 
         return self.pattern.findall(source)  # type: ignore
+
+
+@functools.lru_cache(maxsize=None)
+def compile_pattern(pattern: str) -> Pattern:
+    """Compile a combined pattern once per process."""
+    return re.compile(pattern, re.MULTILINE | re.DOTALL)
@@ -1,14 +1,22 @@
+import hashlib
+import json
+import multiprocessing
 import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
 from dataclasses import field
-from typing import Dict, Iterable, List
+from multiprocessing.util import Finalize
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Set
 
+import pheasant
 from pheasant.core.converter import Converter, Page
 from pheasant.core.decorator import Decorator
+from pheasant.core.page import PageStore, file_digest
 from pheasant.renderers.embed.embed import Embed
 from pheasant.renderers.jupyter.jupyter import CacheMismatchError, Jupyter
-from pheasant.renderers.jupyter.kernel import kernels
-from pheasant.renderers.number.number import Anchor, Header
+from pheasant.renderers.jupyter.kernel import kernels, pool
+from pheasant.renderers.number.number import Anchor, Header, tag_version
 from pheasant.renderers.script.script import Script
+from pheasant.utils.progress import progress_bar_factory
 
 
 class Pheasant(Converter):
@@ -18,10 +26,14 @@ class Pheasant(Converter):
     embed: Embed = field(default_factory=Embed, init=False)
     anchor: Anchor = field(default_factory=Anchor, init=False)
     decorator: Decorator = field(default_factory=Decorator, init=False)
-    pages: Dict[str, Page] = field(default_factory=dict, init=False)
+    pages: PageStore = field(default_factory=PageStore, init=False)
     shutdown: bool = False
     restart: bool = False
     verbose: int = 0  # 0: no info, 1: output, 2: code and output
+    workers: int = 0  # 0 or 1: serial, >1: execute pages in worker processes
+    warm: int = 0  # Number of kernels kept ready in the background for restarts
+    references: Dict[str, Set[str]] = field(default_factory=dict, init=False)
+    fingerprint: str = field(default="", init=False)
 
     def init(self):
         self.anchor.header = self.header
@@ -46,36 +58,78 @@ class Pheasant(Converter):
         -------
         Converted output text.
         """
+        # The session is sent to the kernel when a cell is executed for the first
+        # time in the page, so that a page served from the cache starts no kernel.
         config = self.jupyter.config
-        if config["enabled"] and 'python' in kernels:
-            kernel = kernels['python']
-            cur_dir = config.get("cur_dir")
-            if cur_dir == "page":
-                directory = os.path.dirname(path)
-                kernel.execute(f"import os\nos.chdir(r'{directory}')")
-            elif cur_dir:
-                kernel.execute(f"import os\nos.chdir(r'{cur_dir}')")
-            sys_paths = config.get("sys_paths", [])
-            if sys_paths:
-                kernel.execute("import sys")
-                for p in sys_paths:
-                    code = f"if r'{p}' not in sys.path:\n  sys.path.insert(0, r'{p}')\n"
-                    kernel.execute(code)
-        if path.endswith(".py"):
-            self.convert_by_name(path, "script")
+        cur_dir = config.get("cur_dir") or ""
+        if cur_dir == "page":
+            cur_dir = os.path.dirname(path)
+        sys_paths = config.get("sys_paths", [])
+        self.jupyter.session = dict(cur_dir=cur_dir, sys_paths=sys_paths)
         try:
-            return self.convert_by_name(path, "main")
+            output = self.convert_main(path)
         except CacheMismatchError:
-            return self.convert_by_name(path, "main")
+            output = self.convert_main(path)
         except NameError:
+            output = self.convert_main(path)
+        self.pages[path].meta["numbering"] = self.header.meta["numbering"]
+        self.depend_on_modules(self.pages[path])
+        self.save_tags(self.pages[path])
+        return output
+
+    def convert_main(self, path: str) -> str:
+        """Convert a source file with the main parser.
+
+        The Markdown of a script is parsed cell by cell as soon as the script
+        parser renders it, so that the Markdown of the whole page is not built.
+        """
+        if not path.endswith(".py"):
             return self.convert_by_name(path, "main")
+        outputs = self.stream_by_name(path, "script")
+        return self.convert_by_name(path, "main", self.preprocess_stream(outputs))
+
+    def preprocess_stream(self, outputs: Iterable[str]) -> Iterator[str]:
+        """Preprocess the outputs streamed into the main parser.
+
+        The cells to execute are counted as they come in, because the progress
+        bar has counted the cells in the script source at the page enter.
+        """
+        jupyter = self.jupyter
+        jupyter.progress_bar.total = 0
+        for output in outputs:
+            source = preprocess(output)
+            jupyter.progress_bar.total += jupyter.parser.count(source, jupyter.renders)
+            yield source
+            if len(source) < len(output):  # Cut at the break comment.
+                return
 
     def _convert_from_files(self, paths: Iterable[str]) -> List[str]:
         self.start()
+        self.warm_up()
         paths = list(paths)
+        self.invalidate(paths)
+        self.fingerprint = self.get_fingerprint()
+        if self.dirty:
+            for path in paths:
+                if path not in self.pages:
+                    self.restore(path)
+        if self.workers > 1:
+            self.execute_in_workers(paths)
+
+        outdated = [path for path in paths if self.outdated(path)]
+        versions = self.tag_versions(paths)
+        # After the versions, so that pages referencing removed tags are relinked.
+        self.prune(paths)
+        for tag, context in list(self.header.tag_context.items()):
+            if context["path"] in outdated:  # Tags may be removed from the page.
+                del self.header.tag_context[tag]
+
         self.jupyter.progress_bar.multi = len(paths)
         for k, path in enumerate(paths):
             self.jupyter.progress_bar.step = k + 1
+            if not self.outdated(path) and not self.continue_numbering(path):
+                self.pages.pop(path)
+                outdated.append(path)
             self.convert(path)
 
             if self.shutdown:
@@ -83,11 +137,264 @@ class Pheasant(Converter):
             elif self.restart:
                 kernels.restart()
 
+        current = {tag: tag_version(c) for tag, c in self.header.tag_context.items()}
+        tags = set(versions) | set(current)
+        changed = {tag for tag in tags if versions.get(tag) != current.get(tag)}
+        relinked = set(outdated)
+        for tag in changed:
+            relinked.update(self.references.get(tag, ()))
         for path in paths:
-            self.convert_by_name(path, "link")
+            if path in relinked:
+                self.link(path)
 
         return [self.pages[path].source for path in paths]
 
+    def continue_numbering(self, path: str) -> bool:
+        """Continue the numbering of headers after a page which is not converted.
+
+        Numbers carry over from page to page, so a converted page is used as it
+        is only if it would start from the same numbers, which change with the
+        preceding pages or their order. Return True if continued.
+        """
+        numbering = self.pages[path].meta.get("numbering")
+        if not numbering or not self.header.is_continued(numbering["start"]):
+            return False
+        self.header.continue_from(numbering["end"])
+        return True
+
+    def link(self, path: str) -> str:
+        """Resolve the tag references of a converted page.
+
+        The source before linking is kept, so that the page can be linked again
+        when the tags it references have changed without converting it again.
+        The link parser is skipped for a page without any tag references, whose
+        source is kept only once.
+        """
+        page = self.pages[path]
+        page.source = page.meta.get("unlinked_source", page.source)
+        page.dependencies.pop("tag", None)
+        for referencing in self.references.values():
+            referencing.discard(path)
+        if "{#" in page.source:
+            page.meta["unlinked_source"] = page.source
+            self.convert_by_name(path, "link")
+        for tag in page.dependencies.get("tag", {}):
+            self.references.setdefault(tag, set()).add(path)
+        page.save_dependencies()
+        if self.fingerprint:
+            page.cache.save_conversion(
+                page.digest, self.fingerprint, page.source, page.meta
+            )
+            self.pages.mark_saved(path)
+        return page.source
+
+    def restore(self, path: str) -> bool:
+        """Restore a page converted by another process from its cache.
+
+        The converted source is used if the source, the files it depends on and
+        the fingerprint of the converter are unchanged. The tags and the
+        references of the page are restored as well, so that the page is linked
+        again only if the tags it references have changed. Return True if
+        restored.
+        """
+        page = Page(path)
+        conversion = page.cache.load_conversion()
+        if not conversion or conversion["fingerprint"] != self.fingerprint:
+            return False
+        if conversion["digest"] != file_digest(path) or page.changed_dependencies():
+            return False
+        page.digest = conversion["digest"]
+        page.source = conversion["source"]
+        page.meta = conversion["meta"]
+        page.dependencies = page.cache.load_dependencies()
+        for tag, (_, context) in page.cache.load_tags().items():
+            self.header.tag_context[tag] = dict(context, path=path)
+        for tag in page.dependencies.get("tag", {}):
+            self.references.setdefault(tag, set()).add(path)
+        self.pages[path] = page
+        self.pages.mark_saved(path)
+        return True
+
+    def prune(self, paths: List[str]) -> None:
+        """Forget pages, their tags and their references which are not in paths.
+
+        Pages removed from a site while serving would otherwise be kept in memory.
+        """
+        keep = set(paths)
+        for path in [path for path in self.pages if path not in keep]:
+            self.pages.pop(path)
+        for tag, context in list(self.header.tag_context.items()):
+            if context["path"] not in keep:
+                del self.header.tag_context[tag]
+        for tag, referencing in list(self.references.items()):
+            referencing &= keep
+            if not referencing:
+                del self.references[tag]
+
+    def get_fingerprint(self) -> str:
+        """Return a digest of the version, configs and templates of the renderers.
+
+        Pages converted with another fingerprint are converted again.
+        """
+        sources = [pheasant.__version__, self.jupyter.template_version()]
+        for renderer in self.renderer_iter():
+            for key, value in sorted(renderer.config.items()):
+                if key.endswith("_template"):
+                    value = template_source(value)
+                value = json.dumps(value, sort_keys=True, default=str)
+                sources.append(f"{renderer.name}.{key}={value}")
+        return hashlib.sha1("\n".join(sources).encode("utf-8")).hexdigest()
+
+    def tag_versions(self, paths: List[str]) -> Dict[str, str]:
+        """Return the versions of tags at the last conversion.
+
+        Tags of pages which have not been converted in this process are loaded
+        from their caches.
+        """
+        versions = {}
+        for path in paths:
+            if path not in self.pages:
+                tags = Page(path).cache.load_tags()
+                versions.update({tag: version for tag, (version, _) in tags.items()})
+        for tag, context in self.header.tag_context.items():
+            versions[tag] = tag_version(context)
+        return versions
+
+    def save_tags(self, page: Page) -> None:
+        """Save the tags defined in a page to its cache."""
+        tags = {
+            tag: (tag_version(context), context)
+            for tag, context in self.header.tag_context.items()
+            if context["path"] == page.path
+        }
+        if tags or os.path.exists(page.cache.path):
+            page.cache.save_tags(tags)
+
+    def depend_on_modules(self, page: Page) -> None:
+        """Record modules in `sys_paths` loaded in the kernel as dependencies.
+
+        Modules imported by the preceding pages are recorded as well, which only
+        makes the page converted again more often than needed.
+        """
+        sys_paths = self.jupyter.config.get("sys_paths", [])
+        if not sys_paths or not self.jupyter.config["enabled"]:
+            return
+        if "python" not in kernels or not kernels["python"].client:
+            return
+        for path in page.cache.load_dependencies().get("module", {}):
+            page.depend("module", path)
+        prefixes = tuple(os.path.join(os.path.normpath(p), "") for p in sys_paths)
+        for path in kernels["python"].evaluate(CODE_FOR_MODULES.format(prefixes)):
+            page.depend("module", path)
+
+    def invalidate(self, paths: List[str]) -> None:
+        """Delete the caches of pages which depend on modified modules.
+
+        Kernels are restarted to import the modified modules again.
+        """
+        pages = [Page(path) for path in paths]
+        pages = [page for page in pages if page.changed_dependencies(["module"])]
+        if not pages:
+            return
+        kernels.restart()
+        for page in pages:
+            page.cache.delete()
+            self.pages.pop(page.path, None)
+
+    def warm_up(self) -> None:
+        """Start warm kernels in the background before the first page."""
+        pool.size = self.warm
+        if self.warm and self.jupyter.config["enabled"] and "python" in kernels:
+            kernel = kernels["python"]
+            pool.fill(kernel.name, kernel.init_code)
+
+    def execute_in_workers(self, paths: List[str]) -> None:
+        """Execute modified pages in worker processes to fill their caches.
+
+        Each worker process owns its own kernels and takes whole pages from the
+        executor's queue, so a page is always executed by a single kernel. The
+        serial conversion that follows finds every cell in the cache.
+
+        Parameters
+        ----------
+        paths
+            The source paths to be executed.
+        """
+        config = worker_config(self.jupyter.config)
+        if not config["enabled"]:
+            return
+        paths = [path for path in paths if self.is_modified(path)]
+        if len(paths) < 2:
+            return
+
+        init = f"Executing {len(paths)} pages with {self.workers} workers"
+        progress_bar = progress_bar_factory(total=len(paths), init=init)
+        context = multiprocessing.get_context("spawn")
+        initargs = (config, self.restart, self.shutdown, self.warm)
+        with ProcessPoolExecutor(self.workers, context, init_worker, initargs) as pool:
+            futures = [pool.submit(execute_page, path) for path in paths]
+            for future in as_completed(futures):
+                path = future.result()
+                progress_bar.progress(os.path.relpath(path))
+        progress_bar.finish()
+
+    def is_modified(self, path: str) -> bool:
+        if not self.outdated(path):
+            return False
+        return Page(path).modified
+
+
+def template_source(template) -> str:
+    environment = template.environment
+    if not template.name or environment.loader is None:
+        return ""
+    return environment.loader.get_source(environment, template.name)[0]
+
+
+def worker_config(config: Dict[str, Any]) -> Dict[str, Any]:
+    """Return a picklable copy of a Jupyter config without templates."""
+    return {k: v for k, v in config.items() if not k.endswith("_template")}
+
+
+_worker: Optional[Pheasant] = None
+
+
+def init_worker(
+    config: Dict[str, Any], restart: bool, shutdown: bool, warm: int
+) -> None:
+    """Initialize a worker process with its own converter and kernels."""
+    global _worker
+
+    devnull = os.open(os.devnull, os.O_WRONLY)
+    os.dup2(devnull, 1)  # Progress bars of workers would mix up.
+    # Workers execute pages at the same time, so each owns its kernels.
+    kernels.attach = False
+    _worker = Pheasant(restart=restart, shutdown=shutdown, warm=warm)
+    _worker.jupyter.set_config(**config)
+    _worker.start()
+    _worker.warm_up()
+    Finalize(None, kernels.shutdown, exitpriority=10)
+    Finalize(None, pool.shutdown, exitpriority=5)
+
+
+def execute_page(path: str) -> str:
+    """Execute a page in a worker process and save its cache."""
+    if _worker is None:
+        raise RuntimeError("Worker has not been initialized.")
+    _worker.convert(path)
+    _worker.pages.pop(path, None)
+    if _worker.shutdown:
+        kernels.shutdown()
+    elif _worker.restart:
+        kernels.restart()
+    return path
+
+
+CODE_FOR_MODULES = (
+    "[m.__file__ for m in list(__import__('sys').modules.values())"
+    " if (getattr(m, '__file__', None) or '').startswith({})]"
+)
+
 
 def preprocess(source: str) -> str:
     break_comment = "<!--break-->\n"
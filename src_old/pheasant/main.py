@@ -1,4 +1,5 @@
 import os
+import signal
 import sys
 
 import click
@@ -29,6 +30,20 @@ ext_option = click.option(
 max_option = click.option(
     "--max", default=100, show_default=True, help="Maximum number of files."
 )
+workers_option = click.option(
+    "-j",
+    "--workers",
+    default=0,
+    show_default=True,
+    help="Number of worker processes to execute pages in parallel.",
+)
+warm_option = click.option(
+    "-w",
+    "--warm",
+    default=0,
+    show_default=True,
+    help="Number of kernels kept ready in the background for restarts.",
+)
 paths_argument = click.argument("paths", nargs=-1, type=click.Path(exists=True))
 
 
@@ -41,8 +56,10 @@ paths_argument = click.argument("paths", nargs=-1, type=click.Path(exists=True))
 )
 @ext_option
 @max_option
+@workers_option
+@warm_option
 @paths_argument
-def run(paths, ext, max, restart, shutdown, force, verbose):
+def run(paths, ext, max, restart, shutdown, force, verbose, workers, warm):
     pages = Pages(paths, ext).collect()
 
     length = len(pages)
@@ -56,11 +73,17 @@ def run(paths, ext, max, restart, shutdown, force, verbose):
         for page in pages:
             if page.has_cache:
                 page.cache.delete()
-                click.echo(page.cache.path + " was deleted.")
+                click.echo(page.cache.location + " was deleted.")
 
     from pheasant.core.pheasant import Pheasant
 
-    converter = Pheasant(restart=restart, shutdown=shutdown, verbose=verbose)
+    converter = Pheasant(
+        restart=restart,
+        shutdown=shutdown,
+        verbose=verbose,
+        workers=workers,
+        warm=warm,
+    )
     converter.jupyter.safe = True
     set_config(converter)
     converter.convert_from_files(page.path for page in pages)
@@ -103,8 +126,10 @@ def set_config(converter):
 )
 @ext_option
 @max_option
+@workers_option
+@warm_option
 @paths_argument
-def convert(paths, ext, max, restart, shutdown, force, verbose):
+def convert(paths, ext, max, restart, shutdown, force, verbose, workers, warm):
     pages = Pages(paths, ext).collect()
 
     length = len(pages)
@@ -118,11 +143,17 @@ def convert(paths, ext, max, restart, shutdown, force, verbose):
         for page in pages:
             if page.has_cache:
                 page.cache.delete()
-                click.echo(page.cache.path + " was deleted.")
+                click.echo(page.cache.location + " was deleted.")
 
     from pheasant.core.pheasant import Pheasant
 
-    converter = Pheasant(restart=restart, shutdown=shutdown, verbose=verbose)
+    converter = Pheasant(
+        restart=restart,
+        shutdown=shutdown,
+        verbose=verbose,
+        workers=workers,
+        warm=warm,
+    )
     converter.jupyter.safe = True
     outputs = converter.convert_from_files(page.path for page in pages)
     for page, output in zip(pages, outputs):
@@ -168,7 +199,7 @@ def clean(paths, ext, yes):
         sys.exit()
 
     for cache in caches:
-        click.echo(cache.path)
+        click.echo(cache.location)
 
     click.secho(f"collected {len(caches)} files.", bold=True)
 
@@ -179,7 +210,33 @@ def clean(paths, ext, yes):
 
     for cache in caches:
         cache.delete()
-        click.echo(cache.path + " was deleted.")
+        click.echo(cache.location + " was deleted.")
+
+
+@cli.command(help="Keep kernels running to be shared by other commands.")
+@click.option(
+    "-k",
+    "--kernel",
+    "kernel_names",
+    multiple=True,
+    help="Kernel name(s). Defaults to the kernel for Python.",
+)
+def daemon(kernel_names):
+    from pheasant.renderers.jupyter.kernel import Daemon, kernels
+
+    kernel_names = list(kernel_names) or [kernels.get_kernel_name("python")]
+    daemon = Daemon(kernel_names)
+    daemon.start()
+    click.secho(f"Kernel(s) started: {', '.join(kernel_names)}", bold=True)
+    click.echo("Press Ctrl+C to stop.")
+    signal.signal(signal.SIGTERM, lambda signum, frame: daemon.stop())
+    try:
+        daemon.watch()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        daemon.shutdown()
+        click.secho("Kernel(s) shut down.", bold=True)
 
 
 @cli.command(help="Python script prompt.")
@@ -3,16 +3,18 @@ import io
 import logging
 import os
 import re
-from typing import List
+import shutil
+from typing import Dict, List
 
 import yaml
 from mkdocs.config import config_options
 from mkdocs.plugins import BasePlugin
 from mkdocs.structure.files import get_files
-from mkdocs.utils import markdown_extensions
+from mkdocs.utils import get_relative_url, markdown_extensions
 
 import pheasant
 from pheasant.core.pheasant import Pheasant
+from pheasant.renderers.jupyter.assets import ASSET_PATTERN
 
 logger = logging.getLogger("mkdocs")
 
@@ -22,17 +24,29 @@ markdown_extensions.append(".py")
 class PheasantPlugin(BasePlugin):
     config_scheme = (
         ("jupyter", config_options.Type(bool, default=True)),
+        ("checkpoint", config_options.Type(bool, default=False)),
+        ("concurrent", config_options.Type(bool, default=False)),
+        ("assets", config_options.Type(bool, default=False)),
+        ("batch", config_options.Type(bool, default=False)),
+        ("output_limit", config_options.Type(int, default=0)),
+        ("page_output_limit", config_options.Type(int, default=0)),
         ("cur_dir", config_options.Type(str, default="page")),
         ("sys_paths", config_options.Type(list, default=[])),
         ("nav_number", config_options.Type(bool, default=False)),
         ("dirty", config_options.Type(bool, default=True)),
+        ("workers", config_options.Type(int, default=0)),
+        ("warm", config_options.Type(int, default=0)),
+        ("pages_in_memory", config_options.Type(int, default=0)),
         ("version", config_options.Type(str, default="")),
         ("header", config_options.Type(dict, default={})),  # for backward-compatibility
     )
     converter = Pheasant()
     logger.info("[Pheasant] Converter created.")
+    # Image files to copy into the site directory: name -> source path.
+    assets: Dict[str, str]
 
     def on_config(self, config):
+        self.assets = {}  # For each build.
         cur_dir = self.config["cur_dir"]
         confing_dir = os.path.dirname(config["config_file_path"])
         if cur_dir == "docs":
@@ -44,12 +58,23 @@ class PheasantPlugin(BasePlugin):
         sys_paths = [os.path.normpath(path) for path in sys_paths]
         self.config["sys_paths"] = sys_paths
         self.converter.jupyter.set_config(
-            enabled=self.config["jupyter"], cur_dir=cur_dir, sys_paths=sys_paths
+            enabled=self.config["jupyter"],
+            checkpoint=self.config["checkpoint"],
+            concurrent=self.config["concurrent"],
+            assets=self.config["assets"],
+            batch=self.config["batch"],
+            output_limit=self.config["output_limit"],
+            page_output_limit=self.config["page_output_limit"],
+            cur_dir=cur_dir,
+            sys_paths=sys_paths,
         )
         numbering = self.config["nav_number"]
         if "disabled" in self.config["header"] and self.config["header"]["disabled"]:
             numbering = False
         self.converter.header.set_config(numbering=numbering)
+        self.converter.workers = self.config["workers"]
+        self.converter.warm = self.config["warm"]
+        self.converter.pages.size = self.config["pages_in_memory"]
 
         if self.config["version"]:
             try:
@@ -119,15 +144,40 @@ class PheasantPlugin(BasePlugin):
             page.title = re.sub(r'<.*?>', '', page.title)
         # if page.toc.items:
         #     page.title = page.toc.items[0].title
-        if page.file.abs_src_path not in self.converter.pages:
+        path = page.file.abs_src_path
+        if path not in self.converter.pages:
             return html
         else:
-            extra = self.converter.pages[page.file.abs_src_path].meta["extra_html"]
+            extra = self.converter.pages[path].meta["extra_html"]
+            self.converter.pages.release(path)  # Loaded again if it is read.
+            html = self.resolve_assets(html, page)
             return "\n".join([extra, html])
 
+    def resolve_assets(self, html, page):
+        """Point image sources to the asset files copied into the site directory."""
+        directory = os.path.dirname(page.file.abs_src_path)
+
+        def replace(match):
+            name = match.group("name")
+            self.assets[name] = os.path.join(directory, match.group("path"))
+            url = get_relative_url(f"assets/pheasant/{name}", page.url)
+            return f'src="{url}"'
+
+        return ASSET_PATTERN.sub(replace, html)
+
     def on_post_page(self, output, page, config):  # This is needed for holoviews.
         return output.replace('.js" defer></script>', '.js"></script>')
 
+    def on_post_build(self, config):
+        if not self.assets:
+            return
+        directory = os.path.join(config["site_dir"], "assets", "pheasant")
+        os.makedirs(directory, exist_ok=True)
+        for name, path in self.assets.items():
+            dest = os.path.join(directory, name)
+            if not os.path.exists(dest) and os.path.exists(path):
+                shutil.copyfile(path, dest)
+
     def on_serve(self, server, config, builder):
         self.converter.dirty = self.config["dirty"]
         watcher = server.watcher
@@ -135,8 +185,9 @@ class PheasantPlugin(BasePlugin):
         root = os.path.join(os.path.dirname(pheasant.__file__), "theme")
         server.watch(root, builder)
         watcher.ignore_dirs(".pheasant_cache")
+        # Pages which import modules from `sys_paths` are converted again.
         for path in self.config["sys_paths"]:
-            watcher.ignore_dirs(path)
+            server.watch(path, builder)
         return server
 
 
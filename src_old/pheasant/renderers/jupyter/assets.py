@@ -0,0 +1,82 @@
+import base64
+import hashlib
+import os
+import re
+import struct
+from typing import Dict, List, Optional, Tuple
+
+from pheasant.core.page import ASSET_DIRECTORY, CACHE_DIRECTORY
+
+IMAGE_TYPES = {"image/png": "png", "image/jpeg": "jpg", "image/gif": "gif"}
+
+# An asset source relative to a page, which the mkdocs plugin resolves.
+ASSET_PATTERN = re.compile(
+    r'src="(?P<path>{}/{}/(?P<name>\w+\.\w+))"'.format(CACHE_DIRECTORY, ASSET_DIRECTORY)
+)
+
+
+def image_size(data: bytes, mimetype: str) -> Optional[Tuple[int, int]]:
+    """Return the intrinsic (width, height) of an image, or None if unknown."""
+    try:
+        if mimetype == "image/png" and data[12:16] == b"IHDR":
+            return struct.unpack(">II", data[16:24])
+        if mimetype == "image/gif" and data[:3] == b"GIF":
+            return struct.unpack("<HH", data[6:10])
+        if mimetype == "image/jpeg":
+            return jpeg_size(data)
+    except struct.error:
+        pass
+    return None
+
+
+def jpeg_size(data: bytes) -> Optional[Tuple[int, int]]:
+    index = 2
+    while index + 9 < len(data):
+        if data[index] != 0xFF:
+            return None
+        marker = data[index + 1]
+        length = struct.unpack(">H", data[index + 2 : index + 4])[0]
+        # SOF markers except for DHT (C4), JPG (C8) and DAC (CC).
+        if 0xC0 <= marker <= 0xCF and marker not in (0xC4, 0xC8, 0xCC):
+            height, width = struct.unpack(">HH", data[index + 5 : index + 9])
+            return width, height
+        index += 2 + length
+    return None
+
+
+def write_asset(directory: str, data: bytes, mimetype: str) -> str:
+    """Write image data to a file named by its content hash and return the name.
+
+    A file which already exists is not written again, so that the same image
+    shared by cells or pages is stored once.
+    """
+    name = hashlib.sha1(data).hexdigest() + "." + IMAGE_TYPES[mimetype]
+    path = os.path.join(directory, name)
+    if not os.path.exists(path):
+        os.makedirs(directory, exist_ok=True)
+        with open(path, "wb") as file:
+            file.write(data)
+    return name
+
+
+def extract_assets(outputs: List[Dict], directory: str) -> None:
+    """Move base64 images of outputs into asset files.
+
+    Image data are replaced by an 'assets' dictionary of mimetype to a
+    dictionary of 'src', 'width' and 'height' for the template.
+    """
+    for output in outputs:
+        if "data" not in output or not isinstance(output["data"], dict):
+            continue
+        for mimetype in IMAGE_TYPES:
+            if mimetype not in output["data"] or mimetype in output.get("assets", {}):
+                continue
+            data = base64.b64decode(output["data"][mimetype])
+            name = write_asset(directory, data, mimetype)
+            src = "/".join([CACHE_DIRECTORY, ASSET_DIRECTORY, name])
+            asset = {"src": src, "width": None, "height": None}
+            size = image_size(data, mimetype)
+            if size:
+                asset["width"], asset["height"] = size
+            output["data"][mimetype] = ""
+            output.setdefault("assets", {})[mimetype] = asset
@@ -1,7 +1,17 @@
 import ast
+import base64
+import contextlib
+import importlib
+import inspect
+import io
 import json
+import os
+import pickle
 import re
-from typing import Any, Dict, Iterable, List, Tuple
+import sys
+import types
+from typing import (Any, Callable, Dict, Iterable, Iterator, List, Optional,
+                    Tuple)
 
 import jinja2
 from IPython import get_ipython
@@ -13,6 +23,25 @@ PANDAS_PATTERN = re.compile(
 
 formatter_kwargs: Dict[str, Any] = {}
 
+# Key of the execute request metadata which carries formatter kwargs of a cell.
+FORMATTER_KWARGS = "pheasant_formatter_kwargs"
+
+SOURCE_MIMETYPE = "text/x-pheasant-source"
+
+# Key of the execute request metadata which carries the output budget of a cell:
+# the number of characters a cell can emit and a directory to spill the rest to,
+# with a root directory which the note refers to the spill file from. A quiet
+# budget drops the rest without a note, as for hidden cells.
+OUTPUT_BUDGET = "pheasant_output_budget"
+
+output_budget: Dict[str, Any] = {}
+
+# Key of the execute request metadata which carries the mimetypes to compute for
+# the display data of a cell in the order of priority.
+DISPLAY_PRIORITY = "pheasant_display_priority"
+
+display_priority: List[str] = []
+
 
 def pandas_dataframe_to_html(obj) -> str:
     """Convert a pandas.DataFrame into a <table> tag."""
@@ -235,6 +264,379 @@ def register_formatters(latex_printer=None):  # pragma: no cover
     register_holoviews_formatter(formatters)
     register_sympy_formatter(formatters, latex_printer=latex_printer)
     register_pandas_formatter(formatters)
+    register_formatter_kwargs(ip)
+    register_display_priority(ip)
+    register_output_budget(ip)
+
+
+def request_metadata() -> Dict[str, Any]:  # pragma: no cover
+    """Return the metadata of the execute request which is running."""
+    kernel = getattr(get_ipython(), "kernel", None)
+    if kernel is None or not hasattr(kernel, "get_parent"):
+        return {}
+    return kernel.get_parent().get("metadata", {})
+
+
+def register_formatter_kwargs(ip):  # pragma: no cover
+    """Apply formatter kwargs of each execute request while its cell runs."""
+    callbacks = ip.events.callbacks
+    if apply_formatter_kwargs not in callbacks["pre_run_cell"]:
+        ip.events.register("pre_run_cell", apply_formatter_kwargs)
+        ip.events.register("post_run_cell", clear_formatter_kwargs)
+
+
+def apply_formatter_kwargs(info=None) -> None:  # pragma: no cover
+    """Update `formatter_kwargs` from the metadata of the current request."""
+    kwargs = request_metadata().get(FORMATTER_KWARGS)
+    if kwargs:
+        formatter_kwargs.update(eval(f"dict({kwargs})", get_ipython().user_ns))
+
+
+def clear_formatter_kwargs(result=None) -> None:  # pragma: no cover
+    formatter_kwargs.clear()
+
+
+def register_display_priority(ip):  # pragma: no cover
+    """Compute only the display data of the highest priority for each request.
+
+    Objects are formatted to the mimetypes of the request metadata in order until
+    one of them succeeds, so that representations which pheasant drops are
+    neither computed nor sent.
+    """
+    callbacks = ip.events.callbacks
+    if apply_display_priority in callbacks["pre_run_cell"]:
+        return
+    ip.events.register("pre_run_cell", apply_display_priority)
+    ip.events.register("post_run_cell", clear_display_priority)
+    formatter = ip.display_formatter
+    formatter.format = select_format(formatter.format)
+
+
+def apply_display_priority(info=None) -> None:  # pragma: no cover
+    display_priority[:] = request_metadata().get(DISPLAY_PRIORITY, [])
+
+
+def clear_display_priority(result=None) -> None:  # pragma: no cover
+    display_priority.clear()
+
+
+def select_format(format: Callable) -> Callable:
+    """Wrap `DisplayFormatter.format` so that it stops at the first mimetype.
+
+    Mimetypes are tried in the order of `display_priority`. The same as
+    `DisplayFormatter.format`, a formatter registered for the type of an object
+    takes precedence over its `_repr_mimebundle_`.
+    """
+
+    def _format(obj, include=None, exclude=None):
+        if not display_priority or include or exclude:
+            return format(obj, include=include, exclude=exclude)
+        display_formatter = get_ipython().display_formatter
+        if display_formatter.ipython_display_formatter(obj):
+            return {}, {}
+        bundle, metadata = display_formatter.mimebundle_formatter(
+            obj, include=display_priority
+        )
+        formatters = display_formatter.formatters
+        for mimetype in display_priority:
+            formatter = formatters.get(mimetype)
+            if mimetype in bundle and not has_formatter(formatter, obj):
+                data, md = bundle[mimetype], metadata.get(mimetype)
+            elif formatter is not None:
+                data, md = formatter(obj), None
+                if isinstance(data, tuple) and len(data) == 2:
+                    data, md = data
+            else:
+                continue
+            if data is not None:
+                return {mimetype: data}, {} if md is None else {mimetype: md}
+        return {}, {}
+
+    return _format
+
+
+def has_formatter(formatter, obj) -> bool:
+    if formatter is None:
+        return False
+    try:
+        formatter.lookup(obj)
+    except KeyError:
+        return False
+    return True
+
+
+def register_output_budget(ip):  # pragma: no cover
+    """Truncate outputs of each execute request beyond its budget in the kernel.
+
+    Streams are limited at `write` of stdout and stderr, and display data and
+    execute results at the display formatter, so that oversized outputs are
+    neither sent to the client nor stored in the cache.
+    """
+    callbacks = ip.events.callbacks
+    if apply_output_budget in callbacks["pre_run_cell"]:
+        return
+    ip.events.register("pre_run_cell", apply_output_budget)
+    ip.events.register("post_run_cell", clear_output_budget)
+    for name in ["stdout", "stderr"]:
+        stream = getattr(sys, name)
+        stream.write = limit_write(stream.write, name)
+    formatter = ip.display_formatter
+    formatter.format = limit_format(formatter.format)
+
+
+def apply_output_budget(info=None) -> None:  # pragma: no cover
+    budget = request_metadata().get(OUTPUT_BUDGET)
+    if budget:
+        msg_id = get_ipython().kernel.get_parent()["header"]["msg_id"]
+        output_budget.update(budget, used=0, truncated=set(), msg_id=msg_id)
+
+
+def clear_output_budget(result=None) -> None:  # pragma: no cover
+    output_budget.clear()
+
+
+def spend_output_budget(size: int) -> int:
+    """Spend characters of the budget and return how many of them fit in it."""
+    remaining = max(output_budget["limit"] - output_budget["used"], 0)
+    output_budget["used"] += size
+    return min(size, remaining)
+
+
+def spill(text: str, name: str, ext: str) -> str:
+    """Append text to a file in the spill directory and return a truncation note."""
+    directory = output_budget.get("spill")
+    if not directory:
+        return "[output truncated]"
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, f"{output_budget['msg_id']}-{name}.{ext}")
+    with open(path, "a", encoding="utf-8") as file:
+        file.write(text)
+    path = os.path.relpath(path, output_budget.get("root", os.curdir))
+    return f"[output truncated: see {path}]"
+
+
+def limit_write(write: Callable[[str], Any], name: str) -> Callable[[str], Any]:
+    """Wrap `write` of a stream so that it stops at the output budget."""
+
+    def _write(text: str) -> Any:
+        if not output_budget or not isinstance(text, str):
+            return write(text)
+        size = spend_output_budget(len(text))
+        if size == len(text):
+            return write(text)
+        if output_budget.get("quiet"):
+            return len(text)
+        note = spill(text[size:], name, "txt")
+        if name not in output_budget["truncated"]:
+            output_budget["truncated"].add(name)
+            write(text[:size] + f"\n... {note}\n")
+        return len(text)
+
+    return _write
+
+
+def limit_format(format: Callable) -> Callable:
+    """Wrap `DisplayFormatter.format` so that it stops at the output budget.
+
+    A mimebundle beyond the budget is replaced by a plain text note as a whole,
+    because a truncated HTML or image is broken.
+    """
+
+    def _format(obj, include=None, exclude=None):
+        data, metadata = format(obj, include=include, exclude=exclude)
+        if not output_budget or not data:
+            return data, metadata
+        text = json.dumps(encode_bytes(data), default=str)
+        if spend_output_budget(len(text)) == len(text):
+            return data, metadata
+        if output_budget.get("quiet"):
+            return {}, {}  # Nothing is published for an empty mimebundle.
+        output_budget["truncated"].add("display_data")
+        return {"text/plain": "... " + spill(text + "\n", "data", "jsonl")}, {}
+
+    return _format
+
+
+def output_size(outputs: List[Dict[str, Any]]) -> int:
+    """Return the number of characters of outputs as counted by the budget."""
+    size = 0
+    for output in outputs:
+        if output["type"] == "stream":
+            size += len(output["text"])
+        elif "data" in output:
+            size += len(json.dumps(output["data"], default=str))
+    return size
+
+
+def get_pickler() -> Optional[Callable[[Any], bytes]]:
+    """Return a `dumps` function which can pickle functions and classes by value."""
+    try:
+        import dill
+    except ImportError:
+        pass
+    else:
+        return dill.dumps
+    try:
+        import cloudpickle
+    except ImportError:
+        return None
+    else:
+        return cloudpickle.dumps
+
+
+def user_namespace_items() -> Iterable[Tuple[str, Any]]:
+    ip = get_ipython()
+    hidden = ip.user_ns_hidden
+    for name, value in list(ip.user_ns.items()):
+        if not name.startswith("_") and name not in hidden:
+            yield name, value
+
+
+def save_namespace(path: str) -> bool:
+    """Save the user namespace to `path` as a checkpoint.
+
+    Modules are saved by name. If any other object can't be pickled, no checkpoint
+    is saved because restoring an incomplete namespace would be misleading.
+    """
+    dumps = get_pickler()
+    if dumps is None:
+        return False
+    modules: Dict[str, str] = {}
+    namespace: Dict[str, bytes] = {}
+    for name, value in user_namespace_items():
+        if isinstance(value, types.ModuleType):
+            modules[name] = value.__name__
+            continue
+        try:
+            namespace[name] = dumps(value)
+        except Exception:
+            return False
+    directory = os.path.dirname(path)
+    if directory and not os.path.exists(directory):
+        os.makedirs(directory)
+    with open(path, "wb") as f:
+        pickle.dump({"modules": modules, "namespace": namespace}, f)
+    return True
+
+
+def load_namespace(path: str) -> bool:
+    """Restore the user namespace from a checkpoint saved by `save_namespace`.
+
+    The namespace is left untouched if the checkpoint can't be loaded.
+    """
+    if get_pickler() is None:  # dill or cloudpickle is required to load, too.
+        return False
+    try:
+        with open(path, "rb") as f:
+            checkpoint = pickle.load(f)
+        namespace = {
+            name: pickle.loads(value)
+            for name, value in checkpoint["namespace"].items()
+        }
+        for name, module in checkpoint["modules"].items():
+            namespace[name] = importlib.import_module(module)
+    except Exception:
+        return False
+    ip = get_ipython()
+    for name, _ in user_namespace_items():
+        del ip.user_ns[name]
+    ip.user_ns.update(namespace)
+    return True
+
+
+def evaluate_expressions(codes: List[str]) -> str:
+    """Evaluate expressions in the user namespace and return their outputs as JSON.
+
+    Outputs of each expression are the same as if it were executed as a cell:
+    streams and display data in order, and an execute result or an error with
+    its traceback. `_` and the execution count are updated as well.
+    """
+    ip = get_ipython()
+    results = []
+    for code in codes:
+        outputs: List[Dict[str, Any]] = []
+        value = None
+        with capture_outputs(ip, outputs):
+            try:
+                value = eval(compile(code, ip.compile.cache(code), "eval"), ip.user_ns)
+            except Exception as e:
+                tb = ip.InteractiveTB.structured_traceback(
+                    type(e), e, e.__traceback__, tb_offset=1
+                )
+                error = dict(ename=type(e).__name__, evalue=str(e), traceback=tb)
+                outputs.append(dict(type="error", **error))
+        if value is not None:
+            data, metadata = ip.display_formatter.format(value)
+            data = encode_bytes(data)
+            outputs.append(dict(type="execute_result", data=data, metadata=metadata))
+            ip.displayhook.update_user_ns(value)
+        ip.execution_count += 1
+        results.append(outputs)
+    return json.dumps(results)
+
+
+@contextlib.contextmanager
+def capture_outputs(ip, outputs: List[Dict[str, Any]]) -> Iterator[None]:
+    """Append streams and display data to outputs instead of sending them."""
+
+    class Stream(io.TextIOBase):
+        def __init__(self, name):
+            self.name = name
+
+        def write(self, text):
+            outputs.append(dict(type="stream", name=self.name, text=text))
+            return len(text)
+
+    def publish(data, metadata=None, **kwargs):
+        data = encode_bytes(data)
+        outputs.append(dict(type="display_data", data=data, metadata=metadata or {}))
+
+    display_pub = ip.display_pub
+    original, display_pub.publish = display_pub.publish, publish
+    try:
+        with contextlib.redirect_stdout(Stream("stdout")):
+            with contextlib.redirect_stderr(Stream("stderr")):
+                yield
+    finally:
+        display_pub.publish = original
+
+
+def encode_bytes(data: Dict[str, Any]) -> Dict[str, Any]:
+    """Encode binary data such as images with base64 as the kernel sends them."""
+    return {
+        key: base64.b64encode(item).decode("ascii") if isinstance(item, bytes) else item
+        for key, item in data.items()
+    }
+
+
+class Source(str):
+    """Source code displayed only with its own mimetype."""
+
+    def _repr_mimebundle_(self, include=None, exclude=None):
+        return {SOURCE_MIMETYPE: str(self)}
+
+
+def getsource(obj) -> Source:
+    """Return the source of an object. Dataclasses get their decorator back."""
+    source = inspect.getsource(obj)
+    params = getattr(obj, "__dataclass_params__", None)
+    if params is None or source.startswith("@dataclass"):
+        return Source(source)
+    defaults = [
+        ("init", True),
+        ("repr", True),
+        ("eq", True),
+        ("order", False),
+        ("unsafe_hash", False),
+        ("frozen", False),
+    ]
+    args = [
+        f"{name}={not default}"
+        for name, default in defaults
+        if getattr(params, name) is not default
+    ]
+    args_ = "(" + ", ".join(args) + ")" if args else ""
+    return Source(f"@dataclass{args_}\n{source}")
 
 
 EXTRA_MODULES = ["altair", "bokeh", "holoviews", "sympy"]  # order is important
@@ -308,15 +710,34 @@ DISPLAY_DATA_PRIORITY = [
 ]
 
 
-def select_display_data(outputs: List[Dict]) -> None:
+def select_display_data(
+    outputs: List[Dict], priority: Optional[List[str]] = None
+) -> None:
     """Select display data with the highest priority."""
     for output in outputs:
-        for data_type in DISPLAY_DATA_PRIORITY:
+        for data_type in priority or DISPLAY_DATA_PRIORITY:
             if "data" in output and data_type in output["data"]:
                 output["data"] = {data_type: output["data"][data_type]}
                 break
 
 
+# Options of a cell to request a mimetype of display data before the others.
+DISPLAY_OPTIONS = {
+    "display-" + mimetype.split("/")[1].split("+")[0]: mimetype
+    for mimetype in DISPLAY_DATA_PRIORITY
+}
+
+
+def get_display_priority(option: str) -> List[str]:
+    """Return the mimetypes of display data in the order of priority for options."""
+    for name in option.split():
+        if name in DISPLAY_OPTIONS:
+            mimetype = DISPLAY_OPTIONS[name]
+            rest = [x for x in DISPLAY_DATA_PRIORITY if x != mimetype]
+            return [mimetype] + rest
+    return list(DISPLAY_DATA_PRIORITY)
+
+
 def select_last_display_data(outputs: List[Dict]) -> None:
     last = -1
     for k, output in enumerate(outputs):
@@ -1,18 +1,30 @@
+import ast
+import hashlib
+import json
 import os
 import re
+from concurrent.futures import Future
+from copy import deepcopy
 from dataclasses import dataclass, field
 from itertools import takewhile
-from typing import Dict, Iterator, List, Tuple
+from typing import Any, Dict, Iterator, List, Match, Optional, Tuple
 
+from jinja2 import TemplateNotFound
+
+import pheasant
 from pheasant.core.decorator import commentable, surround
 from pheasant.core.renderer import Renderer
+from pheasant.renderers.jupyter.assets import extract_assets
 from pheasant.renderers.jupyter.filters import get_metadata
-from pheasant.renderers.jupyter.ipython import (extra_html, get_extra_module,
+from pheasant.renderers.jupyter.ipython import (extra_html,
+                                                get_display_priority,
+                                                get_extra_module,
                                                 latex_display_format,
+                                                output_size,
                                                 select_display_data,
                                                 select_last_display_data,
                                                 select_outputs)
-from pheasant.renderers.jupyter.kernel import (format_report, kernels,
+from pheasant.renderers.jupyter.kernel import (Kernel, format_report, kernels,
                                                output_hook)
 from pheasant.utils.progress import ProgressBar, progress_bar_factory
 
@@ -22,20 +34,38 @@ class Cell:
     code: str
     context: Dict[str, str]
     template: str
-    valid: bool = field(default=True, init=False)
+    key: str = field(default="", compare=False)
     cached: bool = field(default=False, compare=False)
     output: str = field(default="", compare=False)
     extra_module: str = field(default="", compare=False)
+    result: Dict[str, Any] = field(default_factory=dict, compare=False)
+    version: str = field(default="", compare=False)
+    output_size: int = field(default=0, compare=False)
 
 
 class CacheMismatchError(BaseException):
-    """Raised if the cache doesn't match input code in safe mode."""
+    """Raised if a cell must be executed after cached cells in safe mode."""
+
+
+# Options which change the rendering of a cell but not its execution. The debug
+# option is not one of them, because it needs all the mimetypes of display data
+# while a cell without it computes only the first one.
+RENDER_OPTIONS = ["hide", "hide-input", "display-last", "freeze"]
 
 
 class Jupyter(Renderer):
     language: str = "python"
     count: int = field(default=0, init=False)
     cache: List[Cell] = field(default_factory=list, init=False)
+    cache_index: Dict[str, Cell] = field(default_factory=dict, init=False)
+    previous: List[Cell] = field(default_factory=list, init=False)
+    chain: Dict[str, str] = field(default_factory=dict, init=False)
+    state: Dict[str, str] = field(default_factory=dict, init=False)
+    pending: Dict[int, Future] = field(default_factory=dict, init=False)
+    batch: List[Tuple[Kernel, str, Cell, int]] = field(default_factory=list, init=False)
+    version: str = field(default="", init=False)
+    output_size: int = field(default=0, init=False)
+    session: Dict[str, Any] = field(default_factory=dict, init=False)
     extra_html: str = field(default="", init=False)
     progress_bar: ProgressBar = field(default_factory=progress_bar_factory, init=False)
 
@@ -45,6 +75,12 @@ class Jupyter(Renderer):
     )
     INLINE_CODE_PATTERN = r"\{\{(?P<code>.+?)\}\}"
     RE_INLINE_CODE_PATTERN = re.compile(INLINE_CODE_PATTERN)
+    PENDING_OUTPUT = '<div data-pheasant-pending="{count}"></div>'
+    # A pending output may have been surrounded by the decorator.
+    RE_PENDING_OUTPUT = re.compile(
+        r'(?:<div class="(?P<class_name>[^"]+)">)?'
+        r'<div data-pheasant-pending="(?P<count>\d+)"></div>(?(class_name)</div>)'
+    )
 
     def init(self):
         self.register(Jupyter.FENCED_CODE_PATTERN, self.render_fenced_code)
@@ -53,14 +89,46 @@ class Jupyter(Renderer):
         templates[0].environment.filters["get_metadata"] = get_metadata
         # safe: If True, code must match cache.
         # verbose: 0: no info, 1: output, 2: code and output
-        self.set_config(enabled=True, safe=False, verbose=0)
+        # checkpoint: If True, save the kernel namespace after each cell.
+        # concurrent: If True, submit cells without waiting for their outputs.
+        # assets: If True, write images into files instead of inline data URIs.
+        # batch: If True, evaluate inline expressions between cells in one request.
+        # output_limit: Characters a cell can emit. 0 for no limit.
+        # page_output_limit: Characters the cells of a page can emit. 0 for no limit.
+        #   Not applied with concurrent, because cells are submitted before the
+        #   outputs of the preceding cells are known.
+        self.set_config(
+            enabled=True,
+            safe=False,
+            verbose=0,
+            checkpoint=False,
+            concurrent=False,
+            assets=False,
+            batch=False,
+            output_limit=0,
+            page_output_limit=0,
+        )
 
     def enter(self):
+        self.progress_bar.total = self.parser.count(self.page.source, self.renders)
+        self.version = self.template_version()
+        cells, self.extra_html = self.page.cache.load() or ([], "")
+        self.previous = [cell_from_dict(cell) for cell in cells]
+        self.cache_index = {cell.key: cell for cell in self.previous if cell.key}
+        self.rewind()
+
+    def rewind(self):
+        """Rewind the cell counter and the key chains to the top of the page."""
         self.count = 0
-        self.progress_bar.total = len(self.findall())
-        self.cache, self.extra_html = self.page.cache.load() or ([], "")
+        self.cache = []
+        self.chain = {}
+        self.state = {}
+        self.pending = {}
+        self.batch = []
+        self.output_size = 0
 
     def exit(self):
+        self.page.source = self.collect(self.page.source)
         self.progress_bar.finish(count=self.count)
         extra_modules = set(self.get_extra_modules())
         if extra_modules:
@@ -68,9 +136,28 @@ class Jupyter(Renderer):
         self.page.meta["extra_html"] = self.extra_html
 
         if self.config["enabled"] and self.page.path and self.cache:
+            cells = [cell_to_dict(cell) for cell in self.cache]
             for cell in self.cache:
                 cell.cached = True
-            self.page.cache.save((self.cache, self.extra_html))
+            self.page.cache.save(cells, self.extra_html, self.page.digest)
+            if self.config["checkpoint"]:
+                self.page.cache.prune_checkpoints(cell.key for cell in self.cache)
+
+    def parse(self, source: str = "") -> str:
+        return self.collect(super().parse(source))
+
+    def template_version(self) -> str:
+        """Return a version of rendering which changes with the templates."""
+        sources = [pheasant.__version__, str(self.config["assets"])]
+        environment = self.config["fenced_code_template"].environment
+        for name in ["fenced_code", "inline_code", "macro"]:
+            loader = environment.loader
+            try:
+                source, *_ = loader.get_source(environment, f"{name}.jinja2")
+            except TemplateNotFound:
+                source = ""
+            sources.append(source)
+        return hashlib.sha1("\0".join(sources).encode("utf-8")).hexdigest()
 
     def get_extra_modules(self) -> Iterator[str]:
         for cell in self.cache:
@@ -98,7 +185,8 @@ class Jupyter(Renderer):
     @commentable("code")
     def render_inline_code(self, context, splitter, parser) -> Iterator[str]:
         if context['code'].strip() == "# cache:clear":
-            self.cache = []
+            self.cache_index = {}
+            self.previous = []
             yield ""
             return
         code, context["option"] = split_option(context["code"])
@@ -114,25 +202,30 @@ class Jupyter(Renderer):
         self.count += 1
 
         cell = Cell(code, context, template)
-        if len(self.cache) >= self.count:
-            cached = self.cache[self.count - 1]
-            if "freeze" in context["option"] or cell == cached:
-                if self.page.path and (self.count - 1) % 5 == 0:
-                    relpath = os.path.relpath(self.page.path)
-                    self.progress_bar.progress(relpath, count=self.count)
-                return surround(cached.output, "cached")
-            elif self.page.path and self.config["safe"]:
-                self.page.cache.delete()
-                self.progress_bar.finish(done=False)
-                raise CacheMismatchError
+        self.language = context.get("language", self.language)
+        kernel_name = kernels.get_kernel_name(self.language)
+        # Cells executed by a kernel depend on all the preceding cells in the
+        # same language. Other cells depend on nothing but themselves.
+        parent = self.chain.get(self.language, "") if kernel_name else ""
+        cell.key = cell_key(parent, cell)
+        if kernel_name:
+            self.chain[self.language] = cell.key
+
+        cached = self.cache_index.get(cell.key)
+        frozen = cached is None and "freeze" in context["option"]
+        if frozen and len(self.previous) >= self.count:
+            cached = self.previous[self.count - 1]
+        if cached is not None:
+            output = self.render_cached(cached, cell)
+            if output is not None:
+                if frozen and kernel_name:  # The next cells follow the frozen one.
+                    self.chain[self.language] = cached.key
+                return output
 
         if not self.config["enabled"]:
             report = {"count": self.count}
             return self.render(template, context, outputs=[], report=report)
 
-        self.language = context.get("language", self.language)
-        kernel_name = kernels.get_kernel_name(self.language)
-
         if not kernel_name:
             report = {"count": self.count}
             cell.output = self.render(template, context, outputs=[], report=report)
@@ -141,18 +234,34 @@ class Jupyter(Renderer):
 
         kernel = kernels.get_kernel(kernel_name)
         kernel.start(silent=self.page.path == "")
+        concurrent = self.config["concurrent"] and "inspect" not in context["option"]
+        if not concurrent:
+            self.wait()
+        kernel.setup(self.session, wait=not concurrent)
+        if parent and self.state.get(self.language, "") != parent:
+            # The kernel has skipped some cached cells this cell depends on.
+            self.wait()
+            restored = self.restore(kernel, parent)
+            if not restored and self.page.path and self.config["safe"]:
+                self.page.cache.delete()
+                self.progress_bar.finish(done=False)
+                raise CacheMismatchError
+        self.state[self.language] = cell.key
 
         if self.count == 1:
             self.progress_bar.progress("Start", count=self.count)
 
-        kwargs = ""
+        if self.batchable(cell, concurrent):
+            return self.defer(kernel, kernel_name, cell)
+        self.flush()
+
+        if concurrent:
+            return self.submit(kernel, kernel_name, cell)
+
+        kwargs, budget = "", self.output_budget(context["option"])
+        priority = self.display_priority(context["option"])
         if self.language == "python":
             _, kwargs = split_kwargs_from_option(context["option"])
-            if kwargs:
-                kernel.execute(
-                    "from pheasant.renderers.jupyter.ipython import formatter_kwargs\n"
-                    f"formatter_kwargs.update(dict({kwargs}))"
-                )
 
         verbose = self.config["verbose"]
 
@@ -161,7 +270,8 @@ class Jupyter(Renderer):
                 codes = [self.language + "> " + line for line in code.split("\n")]
                 print("\n".join(codes))
             func = kernel.inspect if "inspect" in context["option"] else kernel.execute
-            outputs = func(code, output_hook=output_hook if verbose else None)
+            hook = output_hook if verbose else None
+            outputs = func(code, hook, kwargs, budget, priority)
             report = format_report(kernel.report)
             report["count"] = self.count
             return outputs, report
@@ -172,14 +282,218 @@ class Jupyter(Renderer):
 
         outputs, report = self.progress_bar.progress(execute, format, self.count)
 
-        if kwargs:
-            kernel.execute(
-                "from pheasant.renderers.jupyter.ipython import formatter_kwargs\n"
-                "formatter_kwargs.clear()"
-            )
+        if self.config["checkpoint"] and self.page.path:
+            kernel.checkpoint(self.page.cache.checkpoint_path(cell.key))
+
+        cell.output = self.render_outputs(cell, kernel_name, outputs, report)
+        self.update_cache(cell)
+        return cell.output
+
+    def render_cached(self, cached: Cell, cell: Cell) -> Optional[str]:
+        """Return the output of a cached cell without execution.
+
+        The saved HTML is used as it is if the templates and the display options
+        are unchanged. Otherwise the raw outputs are rendered again. None is
+        returned if the cell must be executed, for example if a hidden cell is
+        shown now, because only its errors are cached.
+        """
+        if is_hidden(cached) and not is_hidden(cell):
+            return None
+        changed = cached.key == cell.key and cached.context != cell.context
+        if changed or cached.version != self.version:
+            result = cached.result
+            if not result and self.page.path:
+                result = self.page.cache.load_result(cached.key) or {}
+            if result:
+                if changed:
+                    cached.context = cell.context
+                outputs = deepcopy(result["outputs"])
+                report = dict(result["report"], count=self.count)
+                cached.output = self.render_outputs(
+                    cached, result["kernel_name"], outputs, report
+                )
+                cached.cached = False  # The new output is saved at the page exit.
+            elif changed:
+                return None
+        if not cached.output:  # Outputs are loaded lazily.
+            cached.output = self.page.cache.load_output(cached.key)
+        self.output_size += cached.output_size
+        self.cache.append(cached)
+        if self.page.path and (self.count - 1) % 5 == 0:
+            relpath = os.path.relpath(self.page.path)
+            self.progress_bar.progress(relpath, count=self.count)
+        return surround(cached.output, "cached")
+
+    def submit(self, kernel: Kernel, kernel_name: str, cell: Cell) -> str:
+        """Submit a cell to the kernel and return a placeholder for its output.
+
+        The kernel executes the cell while the page is being parsed. Its outputs
+        are rendered on the event loop thread as soon as the kernel becomes idle,
+        and `collect` replaces the placeholder at the page exit.
+        """
+        count = self.count
+        kwargs, budget = "", self.output_budget(cell.context["option"])
+        priority = self.display_priority(cell.context["option"])
+        if self.language == "python":
+            _, kwargs = split_kwargs_from_option(cell.context["option"])
+
+        def render(outputs, report):
+            report["count"] = count
+            cell.output = self.render_outputs(cell, kernel_name, outputs, report)
+            return cell.output
 
+        verbose = self.config["verbose"]
+        if verbose >= 2:
+            codes = [self.language + "> " + line for line in cell.code.split("\n")]
+            print("\n".join(codes))
+        hook = output_hook if verbose else None
+        self.pending[count] = kernel.submit(
+            cell.code,
+            hook,
+            render,
+            formatter_kwargs=kwargs,
+            output_budget=budget,
+            display_priority=priority,
+        )
+
+        if self.config["checkpoint"] and self.page.path:
+            path = self.page.cache.checkpoint_path(cell.key)
+            kernel.checkpoint(path, wait=False)
+
+        self.update_cache(cell)
+        return self.PENDING_OUTPUT.format(count=count)
+
+    def wait(self) -> None:
+        """Wait for the submitted cells before a blocking request to the kernel.
+
+        The kernel takes requests from the blocking and the asynchronous clients
+        in turn, so a blocking request could overtake the submitted cells and see
+        the namespace before them.
+        """
+        if self.config["concurrent"]:  # Otherwise pending cells are batched ones.
+            for future in self.pending.values():
+                future.result()
+
+    def output_budget(self, option: str) -> Optional[Dict[str, Any]]:
+        """Return the output budget of the next cell, or None if unlimited.
+
+        A cell can emit the smaller of the limit per cell and what the cells
+        before, executed or cached, have left of the limit per page. The limit per
+        page is not applied with concurrent execution. The rest of the outputs
+        is spilled to files in the cache directory, which the truncation note
+        refers to relative to the page. A hidden cell emits nothing but errors.
+        Only IPython kernels have the budget.
+        """
+        if self.language != "python":
+            return None
+        if "hide" in option.split():
+            return {"limit": 0, "quiet": True}
+        limits = []
+        if self.config["output_limit"]:
+            limits.append(self.config["output_limit"])
+        if self.config["page_output_limit"] and not self.config["concurrent"]:
+            remaining = self.config["page_output_limit"] - self.output_size
+            limits.append(max(remaining, 0))
+        if not limits:
+            return None
+        budget: Dict[str, Any] = {"limit": min(limits)}
+        if self.page.path:  # Absolute, because the kernel has its own directory.
+            budget["spill"] = os.path.abspath(self.page.cache.spill_directory)
+            budget["root"] = os.path.dirname(os.path.abspath(self.page.path))
+        return budget
+
+    def display_priority(self, option: str) -> Optional[List[str]]:
+        """Return the mimetypes of display data for the kernel to compute in order.
+
+        The kernel computes only the first mimetype which an object can be
+        formatted to, which is the one `select_display_data` selects. All of them
+        are computed for the debug option, which shows them.
+        """
+        if self.language != "python" or "debug" in option.split():
+            return None
+        return get_display_priority(option)
+
+    def batchable(self, cell: Cell, concurrent: bool) -> bool:
+        """Return True if a cell can be evaluated in a batch of inline expressions.
+
+        Batches are not used with concurrent execution, which already sends cells
+        without waiting, nor with checkpoints, which are saved after each cell.
+        """
+        if not self.config["batch"] or concurrent or self.config["checkpoint"]:
+            return False
+        if cell.template != "inline_code" or self.language != "python":
+            return False
+        if split_kwargs_from_option(cell.context["option"])[1]:
+            return False
+        return is_expression(cell.code)
+
+    def defer(self, kernel: Kernel, kernel_name: str, cell: Cell) -> str:
+        """Add an inline expression to the batch and return a placeholder."""
+        if self.batch and self.batch[0][0] is not kernel:
+            self.flush()
+        self.batch.append((kernel, kernel_name, cell, self.count))
+        self.pending[self.count] = Future()
+        self.update_cache(cell)
+        return self.PENDING_OUTPUT.format(count=self.count)
+
+    def flush(self) -> None:
+        """Evaluate the batch of inline expressions in one request.
+
+        The batch is flushed before any other cell is executed, so that the
+        expressions see the same namespace as if they were executed in order.
+        """
+        if not self.batch:
+            return
+        batch, self.batch = self.batch, []
+        kernel = batch[0][0]
+        results = kernel.evaluate_expressions([cell.code for _, _, cell, _ in batch])
+        report = format_report(kernel.report)
+        for (_, kernel_name, cell, count), outputs in zip(batch, results):
+            report = dict(report, count=count)
+            cell.output = self.render_outputs(cell, kernel_name, outputs, report)
+            self.pending[count].set_result(cell.output)
+
+    def collect(self, source: str) -> str:
+        """Wait for the submitted cells and replace their placeholders in order."""
+        self.flush()
+        if not self.pending:
+            return source
+
+        def format(result):
+            return os.path.relpath(self.page.path)
+
+        for count, future in self.pending.items():
+            self.progress_bar.progress(future.result, format, count)
+
+        def replace(match: Match[str]) -> str:
+            output = self.pending[int(match.group("count"))].result()
+            class_name = match.group("class_name")
+            return surround(output, class_name) if class_name else output
+
+        source = self.RE_PENDING_OUTPUT.sub(replace, source)
+        self.pending = {}
+        return source
+
+    def render_outputs(self, cell: Cell, kernel_name: str, outputs, report) -> str:
+        """Post-process the outputs of a cell and render them with its template.
+
+        The outputs before post-processing are kept in `cell.result` so that the
+        cell can be rendered again without execution.
+        """
+        context, template = cell.context, cell.template
+        cell.output_size = output_size(outputs)
+        if not cell.cached:  # Cached cells are counted by `render_cached`.
+            self.output_size += cell.output_size
+        if "hide" in context["option"].split():
+            return self.render_hidden(cell, kernel_name, outputs, report)
+        if self.config["assets"] and self.page.path:
+            extract_assets(outputs, self.page.cache.asset_directory)
+        cell.result = dict(
+            kernel_name=kernel_name, outputs=deepcopy(outputs), report=dict(report)
+        )
+        cell.version = self.version
         cell.extra_module = get_extra_module(outputs)
-        select_display_data(outputs)
+        select_display_data(outputs, get_display_priority(context["option"]))
 
         if "debug" in context["option"]:
             outputs = [{"type": "execute_result", "data": {"text/plain": outputs}}]
@@ -196,7 +510,7 @@ class Jupyter(Renderer):
         outputs = list(takewhile(not_system_exit, outputs))
         option = context["option"].split()
         code = context["code"].replace("\n\n\n", "\n\n")
-        cell.output = self.render(
+        return self.render(
             template,
             context,
             code=code,
@@ -205,18 +519,91 @@ class Jupyter(Renderer):
             outputs=outputs,
             report=report,
         )
-        self.update_cache(cell)
-        return cell.output
+
+    def render_hidden(self, cell: Cell, kernel_name: str, outputs, report) -> str:
+        """Keep the status of a hidden cell without rendering its template.
+
+        Only errors are kept, which are reported to the console because the
+        page shows nothing of the cell.
+        """
+        errors = [output for output in outputs if output["type"] == "error"]
+        for error in errors:
+            relpath = os.path.relpath(self.page.path) if self.page.path else ""
+            count = report.get("count", self.count)
+            print(f"{relpath}[{count}] {error['ename']}: {error['evalue']}")
+        cell.result = dict(kernel_name=kernel_name, outputs=errors, report=dict(report))
+        cell.version = self.version
+        cell.extra_module = ""
+        return ""
+
+    def restore(self, kernel: Kernel, key: str) -> bool:
+        """Restore the kernel namespace from the checkpoint after a cell."""
+        if not self.config["checkpoint"] or not self.page.path:
+            return False
+        path = self.page.cache.checkpoint_path(key)
+        return os.path.exists(path) and kernel.restore(path)
 
     def update_cache(self, cell: Cell) -> None:
-        if len(self.cache) == self.count - 1:
-            self.cache.append(cell)
-            return
+        self.cache.append(cell)
+        self.cache_index[cell.key] = cell
+
+
+def cell_to_dict(cell: Cell) -> Dict[str, Any]:
+    """Convert a cell into a dictionary for the page cache.
+
+    Outputs of cached cells are not included because they are already saved.
+    """
+    data = dict(
+        code=cell.code,
+        context=cell.context,
+        template=cell.template,
+        extra_module=cell.extra_module,
+        version=cell.version,
+        output_size=cell.output_size,
+    )
+    if cell.cached:
+        return dict(key=cell.key, data=data)
+    return dict(key=cell.key, data=data, output=cell.output, result=cell.result)
+
+
+def cell_from_dict(cell: Dict[str, Any]) -> Cell:
+    data = cell["data"]
+    return Cell(
+        data["code"],
+        data["context"],
+        data["template"],
+        key=cell["key"],
+        cached=True,
+        extra_module=data["extra_module"],
+        version=data.get("version", ""),
+        output_size=data.get("output_size", 0),
+    )
+
+
+def cell_key(parent: str, cell: Cell) -> str:
+    """Return a content-addressed key of a cell chained to its parent's key.
+
+    Options only for rendering are excluded so that they do not force execution.
+    """
+    context = dict(cell.context)
+    if "option" in context:
+        options = context["option"].split()
+        context["option"] = " ".join(x for x in options if x not in RENDER_OPTIONS)
+    context = json.dumps(context, sort_keys=True)
+    data = "\0".join([parent, cell.template, context])
+    return hashlib.sha1(data.encode("utf-8")).hexdigest()
+
+
+def is_hidden(cell: Cell) -> bool:
+    return "hide" in cell.context.get("option", "").split()
+
 
-        self.cache[self.count - 1] = cell
-        if len(self.cache) > self.count:
-            if "freeze" not in cell.context["option"]:
-                self.cache[self.count].valid = False
+def is_expression(code: str) -> bool:
+    try:
+        ast.parse(code, mode="eval")
+    except SyntaxError:
+        return False
+    return True
 
 
 def split_option(code: str) -> Tuple[str, str]:
@@ -1,19 +1,40 @@
 """Jupyter Kernel"""
 import ast
+import asyncio
 import atexit
 import datetime
+import getpass
+import json
+import os
 import re
 import sys
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
 from dataclasses import dataclass, field
-from typing import Any, Dict, Iterator, List, Optional
+from typing import IO, Any, Dict, Iterator, List, Optional, Tuple
 
+import zmq
+from jupyter_client.asynchronous import AsyncKernelClient
+from jupyter_client.blocking import BlockingKernelClient
 from jupyter_client.client import KernelClient
 from jupyter_client.kernelspec import find_kernel_specs, get_kernel_spec
 from jupyter_client.manager import KernelManager
+from jupyter_core.paths import jupyter_runtime_dir
 
+from pheasant.renderers.jupyter.ipython import (DISPLAY_PRIORITY,
+                                                FORMATTER_KWARGS, OUTPUT_BUDGET,
+                                                SOURCE_MIMETYPE)
 from pheasant.utils.progress import progress_bar_factory
 from pheasant.utils.time import format_timedelta_human
 
+try:
+    import fcntl
+except ImportError:  # pragma: no cover
+    import msvcrt
+
+    fcntl = None  # type: ignore
+
 
 @dataclass
 class Kernel:
@@ -22,7 +43,13 @@ class Kernel:
     language: str = ""
     manager: Optional[KernelManager] = field(default=None, init=False)
     client: Optional[KernelClient] = field(default=None, init=False)
+    async_client: Optional[AsyncKernelClient] = field(default=None, init=False)
+    requests: Dict[str, "Request"] = field(default_factory=dict, init=False)
+    readers: List[asyncio.Task] = field(default_factory=list, init=False)
     report: Dict[str, Any] = field(default_factory=dict, init=False)
+    session: Dict[str, Any] = field(default_factory=dict, init=False)
+    attached: bool = field(default=False, init=False)  # Owned by a daemon.
+    lock: Optional[IO] = field(default=None, init=False)  # Held while attached.
 
     def __post_init__(self):
         self.report["total"] = datetime.timedelta(0)
@@ -48,20 +75,30 @@ class Kernel:
                 return self.client
             else:  # pragma: no cover
                 raise RuntimeError(f"Kernel {self.name} is not alive.")
+        if self.attached and self.client:
+            return self.client
+
+        self.session = {}
+        attached = attach(self.name) if kernels.attach else None
+        if attached:
+            self.client, self.lock = attached
+            self.attached = True
+            if self.language == "python":  # Clean up the namespace of a last run.
+                code = "get_ipython().reset(new_session=False)"
+                self.client.execute_interactive(code)
+            return self.client
+
+        launched = pool.take(self.name, self.init_code)
+        if launched:
+            self.manager, self.client = launched
+            return self.client
 
         def start():
-            self.manager = KernelManager(kernel_name=self.name)
-            self.manager.start_kernel()
-            self.client = self.manager.blocking_client()
-            self.client.start_channels()
-            try:
-                self.client.wait_for_ready(timeout=timeout)
-            except TimeoutError:  # pragma: no cover
-                self.manager.shutdown_kernel()
+            launched = launch(self.name, self.init_code, timeout)
+            if not launched:  # pragma: no cover
                 return False
-            else:
-                self.client.execute_interactive(self.init_code)
-                return self.client
+            self.manager, self.client = launched
+            return self.client
 
         init = f"Starting kernel [{self.name}]"
         progress_bar = progress_bar_factory(total=3, init=init)
@@ -81,23 +118,135 @@ class Kernel:
                 break
         else:
             raise TimeoutError  # pragma: no cover
+        pool.fill(self.name, self.init_code)
         return self.client
 
     def shutdown(self) -> None:
+        """Shut down the kernel.
+
+        If the pool keeps warm kernels, the kernel is shut down in the background.
+        """
+        if self.async_client:
+            run(self.disconnect())
+        if self.attached and self.client:  # The kernel is left to the daemon.
+            self.client.stop_channels()
+            self.client = None
+            self.attached = False
+            if self.lock:
+                self.lock.close()  # Another process can attach now.
+                self.lock = None
         if self.manager:
-            self.manager.shutdown_kernel()
+            if pool.size and self.client:
+                pool.discard(self.manager, self.client)
+            else:
+                self.manager.shutdown_kernel()
             del self.client
             self.client = None
             del self.manager
             self.manager = None
 
     def restart(self) -> None:
-        if self.manager:
+        """Restart the kernel.
+
+        If the pool keeps warm kernels, a warm kernel takes the place of this one
+        instead of restarting it.
+        """
+        if self.async_client:
+            run(self.disconnect())
+        if self.attached and self.client:
+            self.session = {}
+            path = daemon_connection_file(self.name)
+            mtime = os.stat(path).st_mtime_ns
+            self.client.shutdown(restart=True)
+            # The daemon starts the kernel again and touches the connection file.
+            for _ in range(300):
+                time.sleep(0.1)
+                if os.path.exists(path) and os.stat(path).st_mtime_ns != mtime:
+                    break
+            self.shutdown()
+            self.start()
+        elif self.manager and pool.size:
+            self.shutdown()
+            self.start()
+        elif self.manager:
+            self.session = {}
             self.manager.restart_kernel()
             if self.client and self.init_code:
+                self.client.wait_for_ready(timeout=10)
                 self.client.execute_interactive(self.init_code)
 
-    def execute(self, code: str, output_hook=None) -> List:
+    def setup(self, session: Dict[str, Any], wait: bool = True) -> None:
+        """Bring the kernel session to the state of a page in one request.
+
+        The state already sent to the kernel is tracked on this side, so that
+        nothing is sent if the session is unchanged.
+
+        Parameters
+        ----------
+        session
+            Dictionary with 'cur_dir', the current directory, and 'sys_paths',
+            the list of paths to be inserted into `sys.path`.
+        wait
+            If False, the request is submitted without waiting.
+        """
+        if self.language != "python":
+            return
+        lines = []
+        cur_dir = session.get("cur_dir", "")
+        cur_dir = cur_dir and os.path.abspath(cur_dir)  # Not from the kernel's.
+        if cur_dir and cur_dir != self.session.get("cur_dir"):
+            lines.extend(["import os", f"os.chdir(r'{cur_dir}')"])
+        sys_paths = self.session.get("sys_paths", [])
+        paths = [path for path in session.get("sys_paths", []) if path not in sys_paths]
+        if paths:
+            lines.append("import sys")
+        for path in paths:
+            lines.append(f"if r'{path}' not in sys.path:")
+            lines.append(f"  sys.path.insert(0, r'{path}')")
+        if not lines:
+            return
+        code = "\n".join(lines)
+        if wait:
+            self.execute(code)
+        else:
+            self.submit(code)
+        self.session = dict(cur_dir=cur_dir or self.session.get("cur_dir", ""))
+        self.session["sys_paths"] = sys_paths + paths
+
+    def execute(
+        self,
+        code: str,
+        output_hook=None,
+        formatter_kwargs: str = "",
+        output_budget: Optional[Dict[str, Any]] = None,
+        display_priority: Optional[List[str]] = None,
+    ) -> List:
+        """Execute code and return the outputs.
+
+        `formatter_kwargs` such as "a=1,b=2" are sent with the execute request and
+        applied to the formatters in the kernel only while the code runs. An
+        `output_budget` such as {"limit": 10000, "spill": directory} makes the
+        kernel truncate outputs beyond the limit of characters before sending.
+        With `display_priority`, a list of mimetypes, the kernel computes only
+        the first mimetype of display data which an object can be formatted to.
+        """
+        return self.execute_request(
+            code, output_hook, formatter_kwargs, output_budget, display_priority
+        )[0]
+
+    def execute_request(
+        self,
+        code: str,
+        output_hook=None,
+        formatter_kwargs: str = "",
+        output_budget: Optional[Dict[str, Any]] = None,
+        display_priority: Optional[List[str]] = None,
+        **kwargs,
+    ) -> Tuple[List, Dict[str, Any]]:
+        """Execute code and return the outputs and the reply message.
+
+        Keyword arguments are passed to the execute request (`user_expressions`).
+        """
         client = self.client or self.start()
         outputs = []
 
@@ -108,59 +257,497 @@ class Kernel:
             if output:
                 outputs.append(output)
 
-        msg = client.execute_interactive(code, output_hook=_output_hook)
+        metadata = request_metadata(formatter_kwargs, output_budget, display_priority)
+        msg = execute_interactive(client, code, _output_hook, metadata, **kwargs)
         update_report(self.report, msg)
-        return list(stream_joiner(outputs))
-
-    def inspect(self, code: str, output_hook=None) -> List:
-        self.execute("import inspect")
-        self.execute(code, output_hook=output_hook)
-        outputs = self.execute(CODE_FOR_INSPECT)
-        if len(outputs) == 1 and outputs[0]["type"] == "execute_result":
-            source = ast.literal_eval(outputs[0]["data"]["text/plain"])
-            return [dict(type="stream", name="source", text=source)]
-        else:
+        return list(stream_joiner(outputs)), msg
+
+    def submit(self, code: str, output_hook=None, postprocess=None, **kwargs) -> Future:
+        """Send code to the kernel without waiting and return a Future of outputs.
+
+        Requests are sent in the order of submission on the event loop thread, so
+        that the kernel executes them in order while the caller goes on. The
+        Future resolves to the same outputs as `execute` when the kernel has sent
+        the reply and become idle. If `postprocess` is given, the Future resolves
+        to `postprocess(outputs, report)` instead, called on the event loop thread
+        with the report of this request. Other keyword arguments are passed to the
+        execute request (`silent`, `user_expressions`, `formatter_kwargs`,
+        `output_budget` and `display_priority`).
+        """
+        self.client or self.start()
+        if not self.async_client:
+            run(self.connect())
+        coroutine = self.execute_async(code, output_hook, postprocess, **kwargs)
+        return asyncio.run_coroutine_threadsafe(coroutine, event_loop())
+
+    async def connect(self) -> None:
+        """Connect an asynchronous client and start reading its channels."""
+        source = self.manager or self.client
+        assert source
+        client = AsyncKernelClient(**source.get_connection_info(session=True))
+        client.start_channels()
+        await client.wait_for_ready(timeout=10)
+        self.async_client = client
+        self.readers = [
+            asyncio.ensure_future(self.read(client.get_iopub_msg)),
+            asyncio.ensure_future(self.read(client.get_shell_msg)),
+        ]
+
+    async def disconnect(self) -> None:
+        for reader in self.readers:
+            reader.cancel()
+        self.readers = []
+        for request in self.requests.values():
+            if not request.future.done():
+                request.future.set_exception(RuntimeError("Kernel shut down."))
+        self.requests.clear()
+        if self.async_client:
+            self.async_client.stop_channels()
+            self.async_client = None
+
+    async def execute_async(
+        self, code: str, output_hook=None, postprocess=None, **kwargs
+    ) -> Any:
+        assert self.async_client
+        # Nothing is awaited before sending, so that requests keep their order.
+        metadata = request_metadata(
+            kwargs.pop("formatter_kwargs", ""),
+            kwargs.pop("output_budget", None),
+            kwargs.pop("display_priority", None),
+        )
+        kwargs["stop_on_error"] = False
+        msg_id = send_execute(self.async_client, code, metadata, **kwargs)
+        request = Request(asyncio.get_running_loop().create_future(), output_hook)
+        self.requests[msg_id] = request
+        msg = await request.future
+        update_report(self.report, msg)
+        outputs = list(stream_joiner(request.outputs))
+        if postprocess:
+            return postprocess(outputs, format_report(self.report))
+        return outputs
+
+    async def read(self, get_msg) -> None:
+        """Dispatch messages from a channel to the requests by their parent."""
+        while True:
+            msg = await get_msg()
+            msg_id = msg["parent_header"].get("msg_id")
+            request = self.requests.get(msg_id)
+            if request is None:  # A message for the blocking client.
+                continue
+            if msg["msg_type"] == "execute_reply":
+                request.reply = msg
+            elif msg["msg_type"] == "status":
+                request.idle = msg["content"]["execution_state"] == "idle"
+            else:
+                if request.output_hook:
+                    request.output_hook(msg)
+                output = output_from_msg(msg)
+                if output:
+                    request.outputs.append(output)
+            if request.reply and request.idle:
+                del self.requests[msg_id]
+                request.future.set_result(request.reply)
+
+    def evaluate_expressions(self, codes: List[str]) -> List[List[Dict[str, Any]]]:
+        """Evaluate Python expressions in one request and return their outputs.
+
+        The outputs of each expression are the same as those of `execute`.
+        Outputs which the kernel sends during the request, for example from
+        another thread, are added to the outputs of the last expression.
+        """
+        client = self.client or self.start()
+        expression = f"{IPYTHON}.evaluate_expressions({codes!r})"
+        expressions = {"value": expression}
+        sent: List[Dict[str, Any]] = []
+
+        def collect(msg):
+            output = output_from_msg(msg)
+            if output:
+                sent.append(output)
+
+        msg = execute_interactive(
+            client, "", collect, {}, silent=True, user_expressions=expressions
+        )
+        update_report(self.report, msg)
+        result = msg["content"]["user_expressions"]["value"]
+        if result["status"] != "ok":
+            raise RuntimeError(f"{result['ename']}: {result['evalue']}")
+        results = json.loads(ast.literal_eval(result["data"]["text/plain"]))
+        if results:
+            results[-1].extend(sent)
+        return [list(stream_joiner(map(output_from_dict, r))) for r in results]
+
+    def evaluate(self, expression: str) -> Any:
+        """Evaluate an expression silently and return its value.
+
+        The execution count, history and `_` of the kernel are not changed.
+        """
+        client = self.client or self.start()
+        expressions = {"value": expression}
+        msg = client.execute_interactive("", silent=True, user_expressions=expressions)
+        result = msg["content"]["user_expressions"]["value"]
+        if result["status"] != "ok":
+            raise RuntimeError(f"{result['ename']}: {result['evalue']}")
+        return ast.literal_eval(result["data"]["text/plain"])
+
+    def checkpoint(self, path: str, wait: bool = True) -> bool:
+        """Save the user namespace to `path`. Return True if saved.
+
+        If `wait` is False, the request is submitted after the cells submitted
+        before and True is returned without waiting for the result. A relative
+        path is relative to this process, not to the current directory of the
+        kernel.
+        """
+        if self.language != "python":
+            return False
+        expression = f"{IPYTHON}.save_namespace(r'{os.path.abspath(path)}')"
+        if not wait:
+            self.submit("", silent=True, user_expressions={"value": expression})
+            return True
+        return self.evaluate(expression)
+
+    def restore(self, path: str) -> bool:
+        """Restore the user namespace from `path`. Return True if restored."""
+        if self.language != "python":
+            return False
+        return self.evaluate(f"{IPYTHON}.load_namespace(r'{os.path.abspath(path)}')")
+
+    def inspect(
+        self,
+        code: str,
+        output_hook=None,
+        formatter_kwargs: str = "",
+        output_budget: Optional[Dict[str, Any]] = None,
+        display_priority: Optional[List[str]] = None,
+    ) -> List:
+        """Execute code and return the source of the last value as a stream.
+
+        The source is looked up in the same request by a user expression, which
+        returns it with its own mimetype. Outputs of the code are returned
+        instead if it fails, and an error if the source is not available.
+        """
+        expressions = {"source": f"{IPYTHON}.getsource(_)"}
+        outputs, msg = self.execute_request(
+            code,
+            output_hook,
+            formatter_kwargs,
+            output_budget,
+            display_priority,
+            user_expressions=expressions,
+        )
+        if msg["content"]["status"] != "ok":
             return outputs
+        result = msg["content"]["user_expressions"]["source"]
+        if result["status"] != "ok":
+            return [output_from_msg(dict(msg_type="error", content=result))]
+        source = result["data"][SOURCE_MIMETYPE]
+        return [dict(type="stream", name="source", text=source)]
+
+
+def launch(
+    kernel_name: str, init_code: str = "", timeout: float = 10, connection_file=""
+) -> Optional[Tuple[KernelManager, KernelClient]]:
+    """Start a kernel and run the init code. Return None if it is not ready."""
+    manager = KernelManager(kernel_name=kernel_name)
+    if connection_file:
+        manager.connection_file = connection_file
+    manager.start_kernel()
+    client = manager.blocking_client()
+    client.start_channels()
+    try:
+        client.wait_for_ready(timeout=timeout)
+    except (TimeoutError, RuntimeError):  # pragma: no cover
+        client.stop_channels()
+        manager.shutdown_kernel(now=True)
+        return None
+    if init_code:
+        client.execute_interactive(init_code)
+    return manager, client
 
 
-CODE_FOR_INSPECT = """
-def getsource(obj):
-    if hasattr(obj, '__dataclass_params__'):
-        is_dataclass = True
-    else:
-        is_dataclass = False
-    source = inspect.getsource(obj)
-    defaults = [('init', True), ('repr', True), ('eq', True), ('order', False),
-                ('unsafe_hash', False), ('frozen', False)]
-    if is_dataclass and not source.startswith('@dataclass'):
-        args = []
-        params = obj.__dataclass_params__
-        if params.init is False:
-            args.append('init=False')
-        if params.repr is False:
-            args.append('repr=False')
-        if params.eq is False:
-            args.append('eq=False')
-        if params.order is True:
-            args.append('order=True')
-        if params.unsafe_hash is True:
-            args.append('unsafe_hash=True')
-        if params.frozen is True:
-            args.append('frozen=True')
-        if args:
-            args = "(" + ", ".join(args) + ")"
-        else:
-            args = ""
-        source = f"@dataclass{args}\\n{source}"
-    return source
-getsource(_)
-"""
+@dataclass
+class KernelPool:
+    """Kernels started and initialized in the background to be taken when needed.
+
+    Kernels are launched in threads, so that starting or restarting a kernel takes
+    a warm kernel from the pool instead of waiting for a new one.
+    """
+
+    size: int = 0  # Number of kernels kept ready for each kernel name.
+    spares: Dict[str, List[Future]] = field(default_factory=dict)
+    executor: Optional[ThreadPoolExecutor] = field(default=None, init=False)
+
+    def fill(self, kernel_name: str, init_code: str = "") -> None:
+        """Launch kernels in the background until `size` kernels are spared."""
+        if not self.size:
+            return
+        if self.executor is None:
+            self.executor = ThreadPoolExecutor(thread_name_prefix="pheasant-kernel")
+            atexit.register(self.shutdown)
+        spares = self.spares.setdefault(kernel_name, [])
+        while len(spares) < self.size:
+            spares.append(self.executor.submit(launch, kernel_name, init_code))
+
+    def take(
+        self, kernel_name: str, init_code: str = ""
+    ) -> Optional[Tuple[KernelManager, KernelClient]]:
+        """Take a spared kernel, waiting for it if it is still starting.
+
+        Returns None if no kernel has been spared for the kernel name.
+        """
+        spares = self.spares.get(kernel_name)
+        if not spares:
+            return None
+        launched = spares.pop(0).result()
+        self.fill(kernel_name, init_code)
+        return launched
+
+    def discard(self, manager: KernelManager, client: KernelClient) -> None:
+        """Shut down a kernel in the background."""
+        client.stop_channels()
+        if self.executor:
+            try:
+                self.executor.submit(manager.shutdown_kernel)
+                return
+            except RuntimeError:  # The interpreter is shutting down.
+                pass
+        manager.shutdown_kernel()
+
+    def shutdown(self) -> None:
+        """Shut down the spared kernels and wait for discarded ones."""
+        for spares in self.spares.values():
+            for future in spares:
+                launched = future.result()
+                if launched:
+                    launched[1].stop_channels()
+                    launched[0].shutdown_kernel(now=True)
+        self.spares.clear()
+        if self.executor:
+            self.executor.shutdown()
+            self.executor = None
+
+
+pool = KernelPool()
+
+
+def daemon_connection_file(kernel_name: str) -> str:
+    """Return the path of the connection file of a kernel owned by the daemon."""
+    return os.path.join(jupyter_runtime_dir(), "pheasant", f"kernel-{kernel_name}.json")
+
+
+def attach(
+    kernel_name: str, timeout: float = 2
+) -> Optional[Tuple[KernelClient, IO]]:
+    """Connect to a kernel owned by a running daemon.
+
+    A process attaches to the kernel only while it holds the lock file of the
+    kernel, so that processes never share the namespace and the current
+    directory of a kernel. Returns the client and the lock file to be closed when
+    detached, or None if no daemon is running or the kernel is in use.
+    """
+    path = daemon_connection_file(kernel_name)
+    if not os.path.exists(path):
+        return None
+    lock = lock_file(os.path.splitext(path)[0] + ".lock")
+    if lock is None:
+        return None
+    client = BlockingKernelClient(connection_file=path)
+    try:
+        client.load_connection_file()
+        client.start_channels()
+        client.wait_for_ready(timeout=timeout)
+    except (OSError, ValueError, RuntimeError):  # A stale connection file.
+        client.stop_channels()
+        lock.close()
+        return None
+    return client, lock
+
+
+def lock_file(path: str) -> Optional[IO]:
+    """Open and lock a file exclusively. Return None if locked by another.
+
+    The lock is released when the file is closed or the process exits.
+    """
+    file = open(path, "a")
+    try:
+        if fcntl:
+            fcntl.flock(file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        else:  # pragma: no cover
+            msvcrt.locking(file.fileno(), msvcrt.LK_NBLCK, 1)
+    except OSError:
+        file.close()
+        return None
+    return file
+
+
+@dataclass
+class Daemon:
+    """Long-lived kernels shared by pheasant processes on the same machine.
+
+    Each kernel writes its connection file to the runtime directory, from where
+    `Kernel.start` attaches to it instead of starting a new kernel. One process
+    at a time can attach to a kernel, and the others start their own. A kernel
+    which has exited, for example by a restart request, is started again with the
+    same connection file, which is touched when the kernel is ready.
+    """
+
+    kernel_names: List[str]
+    interval: float = 0.2
+    managers: Dict[str, KernelManager] = field(default_factory=dict, init=False)
+    stopped: threading.Event = field(default_factory=threading.Event, init=False)
+
+    def start(self) -> None:
+        for kernel_name in self.kernel_names:
+            path = daemon_connection_file(kernel_name)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            init_code = Kernel(kernel_name).init_code
+            launched = launch(kernel_name, init_code, connection_file=path)
+            if not launched:  # pragma: no cover
+                raise TimeoutError(f"Kernel {kernel_name} is not ready.")
+            launched[1].stop_channels()
+            self.managers[kernel_name] = launched[0]
+
+    def watch(self) -> None:
+        """Start exited kernels again until `stop` is called."""
+        while not self.stopped.wait(self.interval):
+            for kernel_name, manager in self.managers.items():
+                if not manager.is_alive():
+                    self.revive(kernel_name, manager)
+
+    def revive(self, kernel_name: str, manager: KernelManager) -> None:
+        manager.restart_kernel(now=True)
+        client = manager.blocking_client()
+        client.start_channels()
+        try:
+            client.wait_for_ready(timeout=10)
+            init_code = Kernel(kernel_name).init_code
+            if init_code:
+                client.execute_interactive(init_code)
+        finally:
+            client.stop_channels()
+        os.utime(manager.connection_file)
+
+    def stop(self) -> None:
+        self.stopped.set()
+
+    def shutdown(self) -> None:
+        for manager in self.managers.values():
+            manager.shutdown_kernel(now=True)  # The connection file is removed.
+        self.managers.clear()
+
+
+@dataclass
+class Request:
+    """An execute request submitted to a kernel through the asynchronous client."""
+
+    future: asyncio.Future
+    output_hook: Any = None
+    outputs: List[Dict[str, Any]] = field(default_factory=list)
+    reply: Optional[Dict[str, Any]] = None
+    idle: bool = False
+
+
+_loop: Optional[asyncio.AbstractEventLoop] = None
+
+
+def event_loop() -> asyncio.AbstractEventLoop:
+    """Return the event loop running in a daemon thread for asynchronous clients."""
+    global _loop
+
+    if _loop is None:
+        _loop = asyncio.new_event_loop()
+        thread = threading.Thread(target=_loop.run_forever, daemon=True)
+        thread.start()
+    return _loop
+
+
+def request_metadata(
+    formatter_kwargs: str,
+    output_budget: Optional[Dict[str, Any]] = None,
+    display_priority: Optional[List[str]] = None,
+) -> Dict[str, Any]:
+    """Return the metadata of an execute request with the options of a cell."""
+    metadata: Dict[str, Any] = {}
+    if formatter_kwargs:
+        metadata[FORMATTER_KWARGS] = formatter_kwargs
+    if output_budget is not None:
+        metadata[OUTPUT_BUDGET] = output_budget
+    if display_priority:
+        metadata[DISPLAY_PRIORITY] = display_priority
+    return metadata
+
+
+def send_execute(
+    client: KernelClient, code: str, metadata: Dict[str, Any], **kwargs
+) -> str:
+    """Send an execute request with its own metadata and return the message id.
+
+    The blocking and the asynchronous clients of a kernel share a session, so the
+    metadata are given to the message instead of the session. Keyword arguments
+    update the content of the request as for `client.execute`.
+    """
+    content = dict(
+        code=code,
+        silent=False,
+        store_history=True,
+        user_expressions={},
+        allow_stdin=client.allow_stdin,
+        stop_on_error=True,
+    )
+    content.update(kwargs)
+    msg = client.session.msg("execute_request", content, metadata=metadata)
+    client.shell_channel.send(msg)
+    return msg["header"]["msg_id"]
+
+
+def execute_interactive(
+    client: KernelClient, code: str, output_hook, metadata: Dict[str, Any], **kwargs
+) -> Dict[str, Any]:
+    """Execute code with request metadata and return the reply message.
+
+    Messages of the request are passed to `output_hook` until the kernel becomes
+    idle, and input requests are answered from the console, as done by
+    `client.execute_interactive`.
+    """
+    msg_id = send_execute(client, code, metadata, **kwargs)
+    poller = zmq.Poller()
+    iopub, stdin = client.iopub_channel.socket, client.stdin_channel.socket
+    for socket in (iopub, stdin):
+        if socket is not None:
+            poller.register(socket, zmq.POLLIN)
+    while True:
+        events = dict(poller.poll())
+        if stdin in events:
+            content = client.stdin_channel.get_msg(timeout=0)["content"]
+            read = getpass.getpass if content.get("password") else input
+            client.input(read(content["prompt"]))
+        if iopub not in events:
+            continue
+        msg = client.iopub_channel.get_msg(timeout=0)
+        if msg["parent_header"].get("msg_id") != msg_id:
+            continue
+        output_hook(msg)
+        if msg["msg_type"] == "status" and msg["content"]["execution_state"] == "idle":
+            break
+    while True:
+        msg = client.get_shell_msg()
+        if msg["parent_header"].get("msg_id") == msg_id:
+            return msg
+
+
+def run(coroutine) -> Any:
+    """Run a coroutine on the event loop thread and wait for the result."""
+    return asyncio.run_coroutine_threadsafe(coroutine, event_loop()).result()
+
+
+IPYTHON = "__import__('pheasant.renderers.jupyter.ipython', fromlist=[''])"
 
 
 @dataclass
 class Kernels:
     _kernel_names: Dict[str, list] = field(default_factory=dict)
     kernels: Dict[str, Kernel] = field(default_factory=dict)
+    attach: bool = True  # If False, kernels of a daemon are not attached to.
 
     @property
     def kernel_names(self) -> Dict[str, list]:
@@ -266,43 +853,75 @@ def output_from_msg(msg: Dict[str, Any]) -> Optional[dict]:
         return None
 
 
+def output_from_dict(output: Dict[str, Any]) -> Dict[str, Any]:
+    """Convert an error with a raw traceback as in a message into an output."""
+    if output["type"] == "error" and isinstance(output["traceback"], list):
+        return output_from_msg(dict(msg_type="error", content=output)) or output
+    return output
+
+
 def stream_joiner(outputs: List[Dict]) -> Iterator[Dict]:
-    name = text = ""
+    name = ""
+    texts: List[str] = []
     for output in outputs:
         if output["type"] != "stream":
-            if text:
-                yield stream_cell(name, text)
-                name = text = ""
+            if texts:
+                yield stream_cell(name, "".join(texts))
+                name, texts = "", []
             yield output
             continue
         if not name:
             name = output["name"]
         if output["name"] == name:
-            text += output["text"]
+            texts.append(output["text"])
         else:
-            yield stream_cell(name, text)
-            name, text = output["name"], output["text"]
-    if text:
-        yield stream_cell(name, text)
+            yield stream_cell(name, "".join(texts))
+            name, texts = output["name"], [output["text"]]
+    if texts:
+        yield stream_cell(name, "".join(texts))
 
 
 def stream_cell(name: str, text: str) -> Dict[str, str]:
-    if "\x08" in text:
-        text, source = "", text
-        index = 0
-        for char in source:
-            if char == "\x08":
-                text = text[:-1]
-            elif char == "\r":
-                text = text[:index]
-            elif char == "\n":
-                text += char
-                index = len(text)
-            else:
-                text += char
+    if "\x08" in text or "\r" in text:
+        text = replay_control(text)
     return {"type": "stream", "name": name, "text": text.rstrip()}
 
 
+CONTROL_PATTERN = re.compile("(\r\n|\n|\r|\x08+)")
+
+
+def replay_control(text: str) -> str:
+    """Replay carriage returns and backspaces of a stream like a terminal.
+
+    A carriage return erases the current line and a backspace erases the last
+    character of it. The current line is a list of (chunk, end) pairs, so that
+    erasing is done by moving the end instead of slicing the text.
+    """
+    lines: List[str] = []
+    line: List[List] = []  # [chunk, end]
+    for token in CONTROL_PATTERN.split(text):
+        if not token:
+            continue
+        if token in ("\n", "\r\n"):
+            lines.extend(chunk[:end] for chunk, end in line)
+            lines.append("\n")
+            line = []
+        elif token == "\r":
+            line = []
+        elif token[0] == "\x08":
+            count = len(token)
+            while line and count:
+                erased = min(count, line[-1][1])
+                line[-1][1] -= erased
+                count -= erased
+                if not line[-1][1]:
+                    line.pop()
+        else:
+            line.append([token, len(token)])
+    lines.extend(chunk[:end] for chunk, end in line)
+    return "".join(lines)
+
+
 # from nbconvert.filters.ansi
 _ANSI_RE = re.compile("\x1b\\[(.*?)([@-~])")
 
@@ -1,4 +1,6 @@
 """Automatic numbering renderer."""
+import hashlib
+import json
 import os
 import re
 from dataclasses import field
@@ -34,9 +36,64 @@ class Header(Renderer):
         self.meta["ignored_depth"] = 100
         for kind in list(self.config["prefix"].keys()) + ["header", "equation"]:
             self.number_list[kind] = [0] * 6
+        self.meta.setdefault("numbering", empty_numbering())
+
+    def enter(self) -> None:
+        self.meta["numbering"] = empty_numbering()
+
+    def exit(self) -> None:
+        end = self.meta["numbering"]["end"]
+        for kind in end["number_list"]:
+            end["number_list"][kind] = list(self.number_list[kind])
+        if end["ignored_depth"] is not None:
+            end["ignored_depth"] = self.meta["ignored_depth"]
+
+    def is_continued(self, start: Dict[str, Any]) -> bool:
+        """Return True if a page would start from the same numbers as before.
+
+        `start` is the numbering a page continued from the preceding pages, which
+        is kept in `meta["numbering"]` with the numbering it left at its end.
+        """
+        for kind, number_list in start["number_list"].items():
+            if self.number_list.get(kind, [])[: len(number_list)] != number_list:
+                return False
+        depth = start["ignored_depth"]
+        return depth is None or depth == self.meta["ignored_depth"]
+
+    def continue_from(self, end: Dict[str, Any]) -> None:
+        """Continue numbering after a page which is not converted again."""
+        for kind, number_list in end["number_list"].items():
+            if kind != "header" and kind not in self.header_kind.values():
+                self.config["prefix"].setdefault(kind, kind)
+            self.number_list[kind] = list(number_list)
+        if end["ignored_depth"] is not None:
+            self.meta["ignored_depth"] = end["ignored_depth"]
+
+    def use_number(self, kind: str, depth: int) -> None:
+        numbering = self.meta["numbering"]
+        if kind not in numbering["end"]["number_list"]:
+            number_list = self.number_list[kind][: depth + 1]
+            numbering["start"]["number_list"][kind] = number_list
+        self.change_number(kind)
+
+    def change_number(self, kind: str) -> None:
+        self.meta["numbering"]["end"]["number_list"][kind] = []
+
+    def use_ignored_depth(self) -> int:
+        numbering = self.meta["numbering"]
+        if numbering["end"]["ignored_depth"] is None:
+            numbering["start"]["ignored_depth"] = self.meta["ignored_depth"]
+        return self.meta["ignored_depth"]
+
+    def set_ignored_depth(self, depth: int) -> None:
+        self.meta["ignored_depth"] = depth
+        self.meta["numbering"]["end"]["ignored_depth"] = depth
 
     def render_header(self, context, splitter, parser) -> Iterator[str]:
         if context["header"] == "!":
+            for kind in self.number_list:
+                self.change_number(kind)
+            self.set_ignored_depth(100)
             self.start()
             return
         context = self.resolve(context)
@@ -75,6 +132,7 @@ class Header(Renderer):
             kind = context["header"]
             if kind not in self.config["prefix"]:
                 self.number_list[kind] = [0] * 6
+                self.change_number(kind)
                 self.config["prefix"][kind] = kind
         else:
             kind = self.header_kind.get(header, "header")
@@ -88,13 +146,13 @@ class Header(Renderer):
             self.meta["ignored_path"].add(self.page.path)
         elif title.startswith("#"):
             title = title[1:]
-            self.meta["ignored_depth"] = depth
+            self.set_ignored_depth(depth)
         elif self.page.path in self.meta["ignored_path"]:
             pass
-        elif depth > self.meta["ignored_depth"]:
+        elif depth > self.use_ignored_depth():
             pass
         elif self.config["numbering"] or kind != 'header':
-            self.meta["ignored_depth"] = 100
+            self.set_ignored_depth(100)
             numbering = True
 
         # if title.startswith("!"):
@@ -104,12 +162,14 @@ class Header(Renderer):
         if numbering:
             title, number_list = split_number(title)
             if number_list:
+                self.change_number(kind)
                 self.number_list[kind] = [0] * 6
                 self.number_list[kind][depth : depth + len(number_list)] = number_list
                 if kind == "header":
                     depth += len(number_list) - 1
                     context["prefix"] = "#" * (depth + 1)
             else:
+                self.use_number(kind, depth)
                 self.number_list[kind][depth] += 1
                 reset = [0] * (5 - depth)
                 self.number_list[kind][depth + 1 :] = reset
@@ -150,6 +210,17 @@ class Header(Renderer):
         return context
 
 
+def empty_numbering() -> Dict[str, Any]:
+    """Return the numbering which a page continues and leaves to the next page.
+
+    The numbers of a kind are continued up to the depth of its first number in
+    the page, and the ignored depth only if it is read before it is set.
+    """
+    start = dict(number_list={}, ignored_depth=None)
+    end = dict(number_list={}, ignored_depth=None)
+    return dict(start=start, end=end)
+
+
 def get_content_from_cell(cell, kind, splitter, parser) -> str:
     if cell.source.startswith("~~~") and kind in "figure table":
         content = cell.context["source"] + "\n"
@@ -185,6 +256,7 @@ class Anchor(Renderer):
     def render_tag(self, context, splitter, parser) -> Iterator[str]:
         tag = context["tag"]
         context = self.resolve(tag)
+        self.page.depend("tag", context["tag"])
         yield self.render("anchor", context, reference=True)
 
     def resolve(self, tag: str) -> Dict[str, Any]:
@@ -216,6 +288,12 @@ class Anchor(Renderer):
         return context
 
 
+def tag_version(tag_context: Dict[str, Any]) -> str:
+    """Return a version of a tag which changes with its number, title or path."""
+    data = json.dumps(tag_context, sort_keys=True)
+    return hashlib.sha1(data.encode("utf-8")).hexdigest()
+
+
 def normalize_number_list(
     number_list: Dict[str, List[int]], kind: str, depth: int
 ) -> List[int]:
@@ -1,7 +1,8 @@
 import os
+import sqlite3
 
 import pheasant
-from pheasant.core.page import Pages
+from pheasant.core.page import Page, Pages, PageStore, file_digest
 
 
 def test_pages():
@@ -15,3 +16,102 @@ def test_pages():
     d = pages.to_dict()
     assert "pages" in d
     assert isinstance(d['pages'], list)
+
+
+def test_cache(tmpdir):
+    path = tmpdir.join("example.md")
+    path.write("# Title\n")
+    page = Page(path.strpath)
+    assert not page.has_cache
+    assert page.modified
+    assert page.cache.load() is None
+
+    cells = [
+        {"key": "a", "data": {"code": "1"}, "output": "<p>1</p>"},
+        {"key": "b", "data": {"code": "2"}, "output": "<p>2</p>"},
+    ]
+    page.cache.save(cells, "extra")
+    assert page.has_cache
+    assert not page.modified
+    assert page.cache.size == 16
+    assert os.path.basename(page.cache.path) == "cache.db"
+
+    cells, extra_html = page.cache.load()
+    assert extra_html == "extra"
+    assert cells == [
+        {"key": "a", "data": {"code": "1"}},
+        {"key": "b", "data": {"code": "2"}},
+    ]
+    assert page.cache.load_output("b") == "<p>2</p>"
+
+    cells = [
+        {"key": "b", "data": {"code": "2"}},
+        {"key": "c", "data": {}, "output": "3"},
+    ]
+    page.cache.save(cells, "")
+    assert page.cache.load_output("a") == ""
+    assert page.cache.load_output("b") == "<p>2</p>"
+    assert page.cache.load_output("c") == "3"
+
+    other = Page(tmpdir.join("other.md").strpath)
+    other.cache.save([{"key": "b", "data": {}, "output": "x"}], "")
+    page.cache.delete()
+    assert not page.has_cache
+    assert other.cache.load_output("b") == "x"
+
+
+def test_cache_digest(tmpdir):
+    path = tmpdir.join("example.md")
+    path.write("# Title\n")
+    page = Page(path.strpath)
+    page.read()
+    page.cache.save([], "", page.digest)
+    assert page.cache.digest == file_digest(path.strpath)
+    assert not page.modified
+
+    st_mtime = os.stat(path.strpath).st_mtime
+    os.utime(path.strpath, (st_mtime + 10, st_mtime + 10))
+    assert not page.modified
+    path.write("# Title\n\n")
+    assert page.modified
+
+
+def test_cache_schema_version(tmpdir):
+    page = Page(tmpdir.join("example.md").strpath)
+    os.makedirs(os.path.dirname(page.cache.path))
+    connection = sqlite3.connect(page.cache.path)
+    connection.execute("CREATE TABLE page (name TEXT, saved REAL)")
+    connection.commit()
+    connection.close()
+    page.cache.save([{"key": "a", "data": {}, "output": "x"}], "")
+    assert page.cache.load_output("a") == "x"
+
+
+def test_page_store(tmpdir):
+    store = PageStore(size=1)
+    pages = []
+    for name in "abc":
+        page = Page(tmpdir.join(f"{name}.md").strpath)
+        page.source, page.meta = name * 3, {"extra_html": name}
+        page.cache.save_conversion("", "", page.source, page.meta)
+        store[page.path] = page
+        pages.append(page)
+    a, b, c = pages
+    assert a.source == "aaa"  # Not saved, so kept in memory.
+
+    store.mark_saved(a.path)
+    store.mark_saved(b.path)
+    assert a.source == b.source == "" and c.source == "ccc"
+    assert a.path in store and len(store) == 3
+    assert store.peek(a.path).source == ""
+
+    assert store[a.path].source == "aaa" and a.meta == {"extra_html": "a"}
+    store.mark_saved(c.path)
+    assert c.source == ""
+    store.release(a.path)
+    assert a.source == ""
+
+    b.cache.delete()
+    assert store.get(b.path) is None
+    assert b.path not in store
+    assert store.pop(c.path) is c and c.source == ""
@@ -73,3 +73,34 @@ def test_core_parse_with_decorate():
 
     source = "a12aa345"
     assert parser.parse(source) == "{B}<12>[{B}<345>]"
+
+
+def test_core_parse_scan():
+    parser = Parser()
+    a = A()
+    parser.register(a.pattern_d, a.render_digit)
+    parser.register(a.pattern_w, a.render_word)
+
+    source = "1a b2b abb 3bbacb5"
+    matches = parser.scan(source)
+    assert parser.scan(source) is matches
+    assert parser.count(source, ["a__digit"]) == 4
+    assert parser.count(source, ["a__word"]) == 11
+
+    other = Parser()
+    other.register(a.pattern_d, a.render_digit)
+    other.register(a.pattern_w, a.render_word)
+    assert other.compile() is None and other.pattern is parser.pattern
+    assert other.parse(source) == parser.parse(source)
+
+
+def test_core_parse_parts():
+    parser = Parser()
+    a = A()
+    parser.register(a.pattern_d, a.render_digit)
+    parser.register(a.pattern_w, a.render_word)
+
+    source = "1a b2b abb 3bbacb5"
+    parts = iter(["1a b2b ", "abb 3", "bbacb5"])
+    assert parser.parse(parts) == parser.parse(source)
+    assert list(parser.iterparse("1c2")) == ["1", "[4]", "2"]
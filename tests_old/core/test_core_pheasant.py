@@ -1,6 +1,9 @@
 import os
 
+from pheasant.core.page import file_digest
 from pheasant.core.pheasant import Pheasant
+from pheasant.renderers.jupyter.kernel import kernels
+from pheasant.renderers.number.number import tag_version
 
 
 def test_pheasant(tmpdir):
@@ -13,15 +16,293 @@ def test_pheasant(tmpdir):
     assert "pheasant-header" in output
     assert "cell jupyter input" in output
 
-    st_mtime = os.stat(path).st_mtime
-    assert converter.pages[path].st_mtime == st_mtime
+    page = converter.pages[path]
+    assert page.digest == file_digest(path)
     converter.convert(path)
-    assert converter.pages[path].st_mtime == st_mtime
+    assert converter.pages[path] is page
     assert 'class="python">1</code>' in output
 
+    touch(f, f.read())  # Only the timestamp changes, as by a checkout.
+    converter.convert(path)
+    assert converter.pages[path] is page
+    assert not page.modified
+
     f.write("# Title\n## Section\n```python\n2\n```\n")
-    assert st_mtime < os.stat(path).st_mtime
     output = converter.convert(path)
-    assert converter.pages[path].st_mtime > st_mtime
-    assert converter.pages[path].st_mtime == os.stat(path).st_mtime
+    assert converter.pages[path] is not page
+    assert converter.pages[path].digest == file_digest(path)
     assert 'class="python">2</code>' in output
+
+
+def test_pheasant_session(tmpdir):
+    f = tmpdir.join("example.md")
+    f.write("# Title\n```python\nos.getcwd()\n```\n")
+    path = f.strpath
+
+    converter = Pheasant()
+    converter.jupyter.set_config(cur_dir="page")
+    output = converter.convert(path)
+    assert repr(tmpdir.strpath) in output.replace("&#39;", "'")
+
+    kernels.shutdown()
+    converter = Pheasant()
+    converter.jupyter.set_config(cur_dir="page")
+    output = converter.convert(path)
+    assert "cached" in output
+    assert kernels["python"].manager is None
+
+
+def test_pheasant_workers(tmpdir):
+    paths = []
+    for k in range(3):
+        f = tmpdir.join(f"example{k}.md")
+        f.write(f"# Title\n```python\nimport os\nos.getpid() + {k} - {k}\n```\n")
+        paths.append(f.strpath)
+
+    converter = Pheasant(workers=2)
+    outputs = converter.convert_from_files(paths)
+    assert all("cell jupyter input" in output for output in outputs)
+    for path in paths:
+        assert converter.pages[path].has_cache
+        assert not converter.pages[path].modified
+    assert all("cached" in output for output in outputs)
+
+
+def touch(f, content):
+    st_mtime = os.stat(f.strpath).st_mtime if f.exists() else 0
+    f.write(content)
+    os.utime(f.strpath, (st_mtime + 10, st_mtime + 10))
+
+
+def test_pheasant_dependencies(tmpdir):
+    a, b, c = tmpdir.join("a.md"), tmpdir.join("b.txt"), tmpdir.join("c.md")
+    touch(a, "# A\n## Section {#sec#}\n{%b.txt%}\n")
+    touch(b, "text one")
+    touch(c, "# C\nSee {#sec#}.\n")
+    paths = [a.strpath, c.strpath]
+
+    converter = Pheasant()
+    outputs = converter.convert_from_files(paths)
+    assert "text one" in outputs[0]
+    assert "[1.1](a.md#sec)" in outputs[1]
+    page_a, page_c = converter.pages[a.strpath], converter.pages[c.strpath]
+    assert b.strpath in page_a.cache.load_dependencies()["file"]
+    assert "sec" in page_c.cache.load_dependencies()["tag"]
+
+    converter.convert_from_files(paths)
+    assert converter.pages[a.strpath] is page_a
+
+    touch(b, "text two")
+    outputs = converter.convert_from_files(paths)
+    assert "text two" in outputs[0]
+    assert converter.pages[a.strpath] is not page_a
+    assert converter.pages[c.strpath] is page_c
+    assert "[1.1](a.md#sec)" in outputs[1]
+
+    touch(a, "# A\n## First\n## Section {#sec#}\n{%b.txt%}\n")
+    outputs = converter.convert_from_files(paths)
+    assert converter.pages[c.strpath] is page_c
+    assert "[1.2](a.md#sec)" in outputs[1]
+
+
+def test_pheasant_module_dependencies(tmpdir):
+    lib = tmpdir.mkdir("lib")
+    module = lib.join("pheasant_test_module.py")
+    touch(module, "x = 'first'\n")
+    f = tmpdir.join("example.md")
+    code = "import pheasant_test_module as m\nm.x"
+    touch(f, f"# Title\n```python\n{code}\n```\n")
+
+    converter = Pheasant()
+    converter.jupyter.set_config(sys_paths=[lib.strpath])
+    try:
+        output = converter.convert_from_files([f.strpath])[0]
+        assert "first" in output
+        page = converter.pages[f.strpath]
+        assert module.strpath in page.cache.load_dependencies()["module"]
+
+        touch(module, "x = 'second'\n")
+        assert page.modified
+        output = converter.convert_from_files([f.strpath])[0]
+        assert "second" in output
+        assert "cached" not in output
+    finally:
+        converter.jupyter.set_config(sys_paths=[])
+        kernels["python"].execute("del m")
+
+
+def test_pheasant_references(tmpdir):
+    a, c, d = tmpdir.join("a.md"), tmpdir.join("c.md"), tmpdir.join("d.md")
+    touch(a, "# A\n## Section {#sec#}\n")
+    touch(c, "# C\nSee {#sec#}.\n")
+    touch(d, "# D\nNo reference.\n")
+    paths = [a.strpath, c.strpath, d.strpath]
+
+    converter = Pheasant()
+    linked = []
+    convert_by_name = converter.convert_by_name
+
+    def spy(path, name):
+        if name == "link":
+            linked.append(path)
+        return convert_by_name(path, name)
+
+    converter.convert_by_name = spy
+    converter.convert_from_files(paths)
+    assert linked == [c.strpath]  # Tags in headers are resolved in the main pass.
+    assert converter.references == {"sec": {c.strpath}}
+    assert "unlinked_source" in converter.pages[c.strpath].meta
+    assert "unlinked_source" not in converter.pages[d.strpath].meta
+    version, context = converter.pages[a.strpath].cache.load_tags()["sec"]
+    assert context == converter.header.tag_context["sec"]
+    assert version == tag_version(context)
+
+    linked.clear()
+    touch(a, "# A\nText.\n## Section {#sec#}\n")
+    converter.convert_from_files(paths)
+    assert linked == []
+
+    linked.clear()
+    touch(a, "# A\n## Section {#sec#}\n## Section {#new#}\n")
+    converter.convert_from_files(paths)
+    assert linked == []
+
+    linked.clear()
+    touch(a, "# A\n## First\n## Section {#sec#}\n")
+    outputs = converter.convert_from_files(paths)
+    assert linked == [c.strpath]
+    assert "[1.2](a.md#sec)" in outputs[1]
+
+
+def spied_converter(converted):
+    converter = Pheasant()
+    convert_by_name = converter.convert_by_name
+
+    def spy(path, name, *args):
+        converted.append((path, name))
+        return convert_by_name(path, name, *args)
+
+    converter.convert_by_name = spy
+    return converter
+
+
+def test_pheasant_restore(tmpdir):
+    a, c = tmpdir.join("a.md"), tmpdir.join("c.md")
+    touch(a, "# A\n## Section {#sec#}\n```python\n1\n```\n")
+    touch(c, "# C\nSee {#sec#}.\n")
+    paths = [a.strpath, c.strpath]
+    outputs = Pheasant().convert_from_files(paths)
+
+    converted = []
+    converter = spied_converter(converted)  # A new build process.
+    assert converter.convert_from_files(paths) == outputs
+    assert converted == []
+    assert converter.pages[a.strpath].meta["extra_html"] == ""
+    assert converter.references == {"sec": {c.strpath}}
+
+    converter = spied_converter(converted)
+    touch(a, "# A\n## First\n## Section {#sec#}\n```python\n1\n```\n")
+    outputs = converter.convert_from_files(paths)
+    assert converted == [(a.strpath, "main"), (c.strpath, "link")]
+    assert "[1.2](a.md#sec)" in outputs[1]
+
+    converted.clear()
+    converter = spied_converter(converted)
+    converter.header.set_config(numbering=False)
+    converter.convert_from_files(paths)
+    assert (a.strpath, "main") in converted
+
+
+def test_pheasant_restore_numbering(tmpdir):
+    a, b = tmpdir.join("a.md"), tmpdir.join("b.md")
+    touch(a, "# First\n")
+    touch(b, "# Second\n")
+    paths = [a.strpath, b.strpath]
+    outputs = Pheasant().convert_from_files(paths)
+    assert "2</span> Second" in outputs[1]
+
+    converted = []
+    converter = spied_converter(converted)  # A new build process.
+    touch(b, "# Second\nText.\n")
+    outputs = converter.convert_from_files(paths)
+    assert converted == [(b.strpath, "main")]
+    assert "2</span> Second" in outputs[1]
+
+    converted.clear()
+    converter = spied_converter(converted)
+    outputs = converter.convert_from_files(paths[::-1])  # The nav is reordered.
+    assert (a.strpath, "main") in converted
+    assert (b.strpath, "main") in converted
+    assert "1</span> Second" in outputs[0]
+    assert "2</span> First" in outputs[1]
+
+
+def test_pheasant_restore_numbering(tmpdir):
+    a, b = tmpdir.join("a.md"), tmpdir.join("b.md")
+    touch(a, "# First\n## Section\n")
+    touch(b, "# Second\n")
+    paths = [a.strpath, b.strpath]
+    outputs = Pheasant().convert_from_files(paths)
+    assert '2</span> <span class="title">Second' in outputs[1]
+
+    converted = []
+    converter = spied_converter(converted)  # A new build process.
+    touch(b, "# Second\nText.\n")
+    outputs = converter.convert_from_files(paths)
+    assert converted == [(b.strpath, "main")]
+    assert '2</span> <span class="title">Second' in outputs[1]
+
+    converted.clear()
+    converter = spied_converter(converted)
+    outputs = converter.convert_from_files(paths[::-1])  # The nav is reordered.
+    assert (a.strpath, "main") in converted
+    assert '1</span> <span class="title">Second' in outputs[0]
+    assert '2</span> <span class="title">First' in outputs[1]
+
+    converter.convert_from_files(paths)
+    converted.clear()
+    touch(a, "# First\n## Section\n## Section\n")
+    outputs = converter.convert_from_files(paths)
+    assert converted == [(a.strpath, "main")]  # The next page starts from 2.
+    assert '2</span> <span class="title">Second' in outputs[1]
+
+
+def test_pheasant_script(tmpdir):
+    f = tmpdir.join("example.py")
+    f.write("# # Title\n# #Fig A\n# Figure.\n\nprint(1)\n\n# <!--break-->\nprint(2)\n")
+    path = f.strpath
+
+    converter = Pheasant()
+    converter.jupyter.set_config(enabled=False)
+    converter.convert_by_name(path, "script")
+    expected = converter.convert_by_name(path, "main")
+
+    converted = []
+    converter = spied_converter(converted)
+    converter.jupyter.set_config(enabled=False)
+    output = converter.convert(path)
+    assert converted == [(path, "main")]  # The script is streamed into main.
+    assert output == expected
+    assert "Figure" in output
+    assert "print(2)" not in output
+    assert converter.jupyter.progress_bar.total == 1
+
+
+def test_pheasant_page_store(tmpdir):
+    a, b, c = tmpdir.join("a.md"), tmpdir.join("b.md"), tmpdir.join("c.md")
+    touch(a, "# A\n## Section {#sec#}\n")
+    touch(b, "# B\nSee {#sec#}.\n")
+    touch(c, "# C\n```python\n1\n```\n")
+    paths = [a.strpath, b.strpath, c.strpath]
+    converter = Pheasant()
+    converter.pages.size = 1
+    outputs = converter.convert_from_files(paths)
+    assert [converter.pages.peek(path).source for path in paths[:2]] == ["", ""]
+    assert converter.pages[b.strpath].source == outputs[1]
+    assert converter.convert_from_files(paths) == outputs
+
+    outputs = converter.convert_from_files(paths[1:])
+    assert a.strpath not in converter.pages
+    assert converter.header.tag_context == {}
+    assert "Unknown tag: 'sec'" in outputs[0]  # Relinked without the removed tag.
+    assert converter.references == {"sec": {b.strpath}}
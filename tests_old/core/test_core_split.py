@@ -1,3 +1,5 @@
+import pytest
+
 from pheasant.core.base import Base
 from pheasant.core.parser import Parser
 
@@ -41,3 +43,61 @@ def test_split():
     cell = next(splitter)
     assert cell.match is not None
     assert list(cell.render(splitter, parser)) == ["ba"]
+
+
+class Include(Base):
+    pattern = r"\{%(?P<name>.*?)%\}"
+
+    def __post_init__(self):
+        super().__post_init__()
+        self.sources = {}
+
+    def render(self, context, splitter, parser):
+        yield ""
+        splitter.send(self.sources[context["name"]])
+
+
+def split_includes(n: int) -> int:
+    include = Include()
+    include.sources = {"x": "text {%y%} text\n", "y": "end\n"}
+    parser = Parser()
+    parser.register(include.pattern, include.render)
+    scanned = []
+    scan = parser.scan
+
+    def spy(source):
+        scanned.append(len(source))
+        return scan(source)
+
+    parser.scan = spy
+    source = "# Title\n{%x%}\n" * n
+    output = parser.parse(source)
+    assert output == "# Title\ntext end\n text\n\n" * n
+    return sum(scanned)
+
+
+def test_split_includes_linear():
+    # Each source is scanned once. Splitting the rest of a source again after
+    # each include would scan quadratically many characters.
+    size = len("# Title\n{%x%}\n") + len("text {%y%} text\n") + len("end\n")
+    assert split_includes(1000) == 1000 * size
+    assert split_includes(8000) == 8000 * size
+
+
+def test_split_chained_sends_do_not_deepen():
+    include = Include()
+    n = 5000
+    include.sources = {str(k): f"{{%{k + 1}%}}" for k in range(n)}
+    include.sources[str(n)] = "end"
+    parser = Parser()
+    parser.register(include.pattern, include.render)
+    assert parser.parse("{%0%}") == "end"
+
+
+def test_split_max_depth():
+    include = Include()
+    include.sources = {"x": "{%x%} "}
+    parser = Parser()
+    parser.register(include.pattern, include.render)
+    with pytest.raises(RecursionError):
+        parser.parse("{%x%}")
@@ -0,0 +1,64 @@
+import base64
+import struct
+import zlib
+
+from pheasant.core.page import Page
+from pheasant.renderers.jupyter.assets import (ASSET_PATTERN, extract_assets,
+                                               image_size)
+from pheasant.renderers.jupyter.jupyter import Jupyter
+
+
+def png(width, height):
+    def chunk(kind, data):
+        body = kind + data
+        return struct.pack(">I", len(data)) + body + struct.pack(">I", zlib.crc32(body))
+
+    header = struct.pack(">IIBBBBB", width, height, 8, 0, 0, 0, 0)
+    data = zlib.compress(b"".join(b"\0" + b"\0" * width for _ in range(height)))
+    chunks = chunk(b"IHDR", header) + chunk(b"IDAT", data) + chunk(b"IEND", b"")
+    return b"\x89PNG\r\n\x1a\n" + chunks
+
+
+def test_image_size():
+    assert image_size(png(3, 2), "image/png") == (3, 2)
+    assert image_size(b"GIF89a\x05\x00\x04\x00", "image/gif") == (5, 4)
+    jpeg = b"\xff\xd8\xff\xe0\x00\x04\x00\x00\xff\xc0\x00\x11\x08\x00\x07\x00\x06"
+    assert image_size(jpeg + b"\x00" * 16, "image/jpeg") == (6, 7)
+    assert image_size(b"", "image/png") is None
+
+
+def test_extract_assets(tmpdir):
+    data = base64.b64encode(png(3, 2)).decode()
+    outputs = [
+        {"type": "display_data", "data": {"image/png": data}},
+        {"type": "display_data", "data": {"image/png": data}},
+        {"type": "stream", "name": "stdout", "text": "a"},
+    ]
+    directory = tmpdir.join("assets")
+    extract_assets(outputs, directory.strpath)
+    assert len(directory.listdir()) == 1
+    asset = outputs[0]["assets"]["image/png"]
+    assert asset == outputs[1]["assets"]["image/png"]
+    assert asset["width"] == 3 and asset["height"] == 2
+    assert directory.join(asset["src"].split("/")[-1]).read_binary() == png(3, 2)
+    assert outputs[0]["data"]["image/png"] == ""
+
+
+def test_jupyter_assets(tmpdir):
+    data = png(3, 2)
+    f = tmpdir.join("example.md")
+    code = f"from IPython.display import Image\nImage(data={data!r})"
+    f.write(f"```python\n{code}\n```\n")
+
+    jupyter = Jupyter()
+    jupyter.set_config(assets=True)
+    jupyter.page = Page(f.strpath)
+    jupyter.page.read()
+    jupyter.enter()
+    output = jupyter.parse()
+    jupyter.exit()
+    assert "base64" not in output
+    assert 'loading="lazy" width="3" height="2"' in output
+    match = ASSET_PATTERN.search(output)
+    assert tmpdir.join(match.group("path")).read_binary() == data
+    assert "base64" not in jupyter.page.cache.load_output(jupyter.cache[0].key)
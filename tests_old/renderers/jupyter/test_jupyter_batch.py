@@ -0,0 +1,79 @@
+import os
+
+from pheasant.core.page import Page
+from pheasant.renderers.jupyter.jupyter import Jupyter
+from pheasant.renderers.jupyter.kernel import kernels
+
+source = """
+# Title
+
+```python
+a = 1
+```
+
+Inline {{a + 1}}, {{a + 2}}, {{print(a)}} and {{1/0}}.
+
+```python
+a = 10
+```
+
+Inline {{a}}, {{a = 3}} and {{a}}.
+"""
+
+
+def convert(jupyter, path):
+    jupyter.page = Page(path)
+    jupyter.page.read()
+    jupyter.enter()
+    jupyter.page.source = jupyter.parse(jupyter.page.source)
+    jupyter.exit()
+    return jupyter.page.source
+
+
+def test_jupyter_batch(tmpdir, monkeypatch):
+    f = tmpdir.join("example.md")
+    f.write(source)
+    directory = os.path.normpath(os.path.join(__file__, "../templates"))
+    jupyter = Jupyter()
+    jupyter.set_template("fenced_code", directory)
+    expected = convert(jupyter, f.strpath)
+    outputs = [cell.output for cell in jupyter.cache]
+    jupyter.page.cache.delete()
+
+    kernel = kernels["python"]
+    batches = []
+    evaluate_expressions = kernel.evaluate_expressions
+
+    def spy(codes):
+        batches.append(codes)
+        return evaluate_expressions(codes)
+
+    monkeypatch.setattr(kernel, "evaluate_expressions", spy)
+    jupyter = Jupyter()
+    jupyter.set_template("fenced_code", directory)
+    jupyter.set_config(batch=True)
+    output = convert(jupyter, f.strpath)
+    assert "pending" not in output
+    assert batches == [["a + 1", "a + 2", "print(a)", "1/0"], ["a"], ["a"]]
+    assert [cell.output for cell in jupyter.cache] == outputs
+    assert output == expected
+    assert "ZeroDivisionError" in output
+    assert "Inline 10,  and 3." in output
+
+
+def test_kernel_evaluate_expressions(capsys):
+    kernel = kernels["python"]
+    codes = [
+        "print('x') or 1",
+        "None",
+        "__import__('sys').stderr.write('e') and None",
+        "__import__('IPython').display.display(2)",
+        "_ + 1",
+    ]
+    outputs = kernel.evaluate_expressions(codes + ["1/0"])
+    assert outputs[:-1] == [kernel.execute(code) for code in codes]
+    assert outputs[0][0] == {"type": "stream", "name": "stdout", "text": "x"}
+    assert outputs[4][0]["data"] == {"text/plain": "2"}  # `_` is updated.
+    assert outputs[5][0]["ename"] == "ZeroDivisionError"
+    assert "1/0" in outputs[5][0]["traceback"]
+    assert capsys.readouterr().out == ""  # Nothing is printed on this side.
@@ -0,0 +1,152 @@
+import os
+import re
+
+from pheasant.core.page import Page
+from pheasant.renderers.jupyter.ipython import output_size
+from pheasant.renderers.jupyter.jupyter import Jupyter
+from pheasant.renderers.jupyter.kernel import kernels
+
+
+def test_output_budget_stream(tmpdir):
+    kernel = kernels["python"]
+    spill = tmpdir.join("spill")
+    budget = {"limit": 10, "spill": spill.strpath}
+    code = "for k in range(1000):\n    print(k)"
+    outputs = kernel.execute(code, output_budget=budget)
+    assert len(outputs) == 1
+    text = outputs[0]["text"]
+    assert text.startswith("0\n1\n2\n3\n4\n")
+    assert "[output truncated: see " in text
+    assert len(text) < 200
+    (path,) = spill.listdir()
+    assert text[:10] + path.read() == "".join(f"{k}\n" for k in range(1000))
+
+    outputs = kernel.execute(code)
+    assert output_size(outputs) == len(path.read()) + 9  # Without the last "\n".
+
+
+def test_output_budget_display():
+    kernel = kernels["python"]
+    code = "class A:\n    def _repr_html_(self):\n        return 'x' * 1000\nA()"
+    outputs = kernel.execute(code, output_budget={"limit": 100})
+    assert outputs[0]["data"] == {"text/plain": "... [output truncated]"}
+
+    outputs = kernel.execute("A()", output_budget={"limit": 2000})
+    assert outputs[0]["data"]["text/html"] == "x" * 1000
+    outputs = kernel.execute("A()")
+    assert outputs[0]["data"]["text/html"] == "x" * 1000
+
+
+def test_output_budget_image():
+    kernel = kernels["python"]
+    code = "class A:\n    def _repr_png_(self):\n        return bytes(range(256)) * 40"
+    kernel.execute(code)
+    outputs = kernel.execute("A()")
+    size = output_size(outputs)  # Images are counted as base64 strings.
+    outputs = kernel.execute("A()", output_budget={"limit": size})
+    assert "image/png" in outputs[0]["data"]
+    outputs = kernel.execute("A()", output_budget={"limit": size - 1})
+    assert outputs[0]["data"] == {"text/plain": "... [output truncated]"}
+
+
+source = """
+```python
+print('a' * 60)
+```
+
+```python
+print('b' * 60)
+```
+
+```python
+print('c' * 60)
+```
+"""
+
+
+def test_jupyter_page_output_limit(tmpdir):
+    f = tmpdir.join("example.md")
+    f.write(source)
+    directory = os.path.normpath(os.path.join(__file__, "../templates"))
+    jupyter = Jupyter()
+    jupyter.set_template("fenced_code", directory)
+    jupyter.set_config(output_limit=100, page_output_limit=150)
+    jupyter.page = Page(f.strpath)
+    jupyter.page.read()
+    jupyter.enter()
+    output = jupyter.parse()
+    jupyter.exit()
+    assert "a" * 60 in output
+    assert "b" * 60 in output
+    assert "c" * 30 + "\n... [output truncated: see " in output
+    assert os.listdir(jupyter.page.cache.spill_directory)
+
+    f.write(source.replace("'c'", "'d'"))  # The first two cells are cached.
+    jupyter.page = Page(f.strpath)
+    jupyter.page.read()
+    jupyter.enter()
+    output = jupyter.parse()
+    jupyter.exit()
+    assert output.count('class="cached"') == 2
+    assert "d" * 30 + "\n... [output truncated: see " in output
+
+    jupyter.set_config(concurrent=True)
+    assert jupyter.output_budget("")["limit"] == 100
+
+
+def test_jupyter_spill_relative_path(tmpdir):
+    f = tmpdir.mkdir("docs").join("example.md")
+    f.write("```python\nprint('a' * 100)\n```\n")
+    jupyter = Jupyter()
+    jupyter.set_config(output_limit=10)
+    with tmpdir.as_cwd():
+        jupyter.session = dict(cur_dir=".")  # Not the directory of the page.
+        jupyter.page = Page("docs/example.md")
+        jupyter.page.read()
+        jupyter.enter()
+        output = jupyter.parse()
+        jupyter.exit()
+    note = re.search(r"see (\S+)\]", output).group(1)
+    assert note.startswith(".pheasant_cache")
+    assert f.dirpath().join(note).read() == "a" * 90 + "\n"
+
+
+hidden = """
+```python hide
+from IPython.display import HTML, display
+print('a')
+display(HTML('<b>a</b>'))
+1
+```
+
+```python hide
+1/0
+```
+
+```python
+print('b')
+```
+"""
+
+
+def test_jupyter_hide(tmpdir, capsys):
+    kernel = kernels["python"]
+    outputs = kernel.execute("print(1)\n1", output_budget={"limit": 0, "quiet": True})
+    assert outputs == []
+
+    f = tmpdir.join("example.md")
+    f.write(hidden)
+    jupyter = Jupyter()
+    jupyter.page = Page(f.strpath)
+    jupyter.page.read()
+    jupyter.enter()
+    output = jupyter.parse()
+    jupyter.exit()
+    assert output.startswith("\n\n\n\n\n\n")
+    assert "b</code>" in output
+    assert "a</" not in output
+    assert [cell.output for cell in jupyter.cache[:2]] == ["", ""]
+    assert jupyter.cache[0].result["outputs"] == []
+    assert jupyter.cache[1].result["outputs"][0]["ename"] == "ZeroDivisionError"
+    out = capsys.readouterr().out
+    assert "example.md[2] ZeroDivisionError: division by zero" in out
@@ -1,4 +1,8 @@
+import os
+
+from pheasant.core.page import Page
 from pheasant.renderers.jupyter.jupyter import Jupyter
+from pheasant.renderers.jupyter.kernel import kernels
 
 
 def test_cache():
@@ -14,24 +18,141 @@ def test_cache():
     assert len(cache) == 1
     cell = cache[jupyter.count - 1]
     assert cell.output == output
-    assert cell.valid
+    assert cell.key
 
-    jupyter.execute_and_render("2", context, template)
-    jupyter.execute_and_render("3", context, template)
-    jupyter.execute_and_render("4", context, template)
+    for code in ["2", "3", "4"]:
+        jupyter.execute_and_render(code, dict(context, code=code), template)
 
     assert jupyter.count == 4
     assert len(cache) == 4
+    assert len(set(cell.key for cell in cache)) == 4
+
+    jupyter.rewind()
+
+    output = jupyter.execute_and_render("1", context, template)
+    assert "cached" in output
+
+    output = jupyter.execute_and_render("2*2", dict(context, code="2*2"), template)
+    assert "cached" not in output
+
+    output = jupyter.execute_and_render("3", dict(context, code="3"), template)
+    assert "cached" not in output
+    assert jupyter.cache[2].key != cache[2].key
 
-    jupyter.count = 0
 
+def test_cache_insert_other_language():
+    jupyter = Jupyter()
+    context = {"code": "1", "language": "python", "option": ""}
+    template = "fenced_code"
+    jupyter.execute_and_render("1", context, template)
+    jupyter.execute_and_render("2", dict(context, code="2"), template)
+
+    jupyter.rewind()
+    other = {"code": "a", "language": "unknown", "option": ""}
+    output = jupyter.execute_and_render("a", other, template)
+    assert "cached" not in output
     output = jupyter.execute_and_render("1", context, template)
     assert "cached" in output
+    output = jupyter.execute_and_render("2", dict(context, code="2"), template)
+    assert "cached" in output
+    assert jupyter.count == 3
+
+
+def test_cache_render_option():
+    jupyter = Jupyter()
+    kernels["python"].execute("n = 0")
+    context = {"code": "n += 1\nn", "language": "python", "option": ""}
+    output = jupyter.execute_and_render(context["code"], context, "fenced_code")
+    assert ">1</code>" in output
+
+    jupyter.rewind()
+    hidden = dict(context, option="hide-input")
+    output = jupyter.execute_and_render(context["code"], hidden, "fenced_code")
+    assert "cached" in output
+    assert ">1</code>" in output
+    assert 'class="cell jupyter input"' not in output
+    assert jupyter.cache[0].context == hidden
+    assert not jupyter.cache[0].cached
+    assert kernels["python"].execute("n")[0]["data"]["text/plain"] == "1"
 
-    output = jupyter.execute_and_render("2*2", context, template)
+    jupyter.rewind()
+    debug = dict(context, option="debug")  # Executed again for all mimetypes.
+    output = jupyter.execute_and_render(context["code"], debug, "fenced_code")
     assert "cached" not in output
-    assert not cache[2].valid
+    assert kernels["python"].execute("n")[0]["data"]["text/plain"] == "2"
+
 
-    output = jupyter.execute_and_render("3", context, template)
+def test_cache_unhide():
+    jupyter = Jupyter()
+    kernels["python"].execute("n = 0")
+    code = "n += 1\nprint('hello')\nn"
+    context = {"code": code, "language": "python", "option": "hide"}
+    output = jupyter.execute_and_render(code, context, "fenced_code")
+    assert output == ""
+
+    jupyter.rewind()
+    output = jupyter.execute_and_render(code, dict(context, option=""), "fenced_code")
     assert "cached" not in output
-    assert not cache[3].valid
+    assert "hello" in output
+    assert ">2</code>" in output
+
+    jupyter.rewind()
+    output = jupyter.execute_and_render(code, dict(context, option=""), "fenced_code")
+    assert "cached" in output
+    assert "hello" in output
+
+
+def test_cache_template_version(tmpdir):
+    kernels["python"].execute("n = 0")
+    f = tmpdir.join("example.md")
+    f.write("```python\nn += 1\nn\n```\n")
+
+    def convert(jupyter):
+        jupyter.page = Page(f.strpath)
+        jupyter.page.read()
+        jupyter.enter()
+        output = jupyter.parse()
+        jupyter.exit()
+        return output
+
+    jupyter = Jupyter()
+    output = convert(jupyter)
+    assert 'class="cell jupyter output"' in output
+    assert Jupyter().template_version() == jupyter.version
+
+    jupyter = Jupyter()
+    directory = os.path.normpath(os.path.join(__file__, "../templates"))
+    jupyter.set_template("fenced_code", directory)
+    output = convert(jupyter)
+    assert 'class="cached"' in output
+    assert '<div class="output"><pre><code class="python">1</code>' in output
+    assert kernels["python"].execute("n")[0]["data"]["text/plain"] == "1"
+
+    result = jupyter.page.cache.load_result(jupyter.cache[0].key)
+    assert result["kernel_name"] == "python3"
+    assert result["outputs"][0]["data"]["text/plain"] == "1"
+    assert convert(jupyter) == output
+
+
+def test_cache_freeze(tmpdir):
+    kernels["python"].execute("n = 0")
+    f = tmpdir.join("example.md")
+    f.write("```python freeze\nn += 1\nn\n```\n\n```python\nn * 10\n```\n")
+
+    def convert():
+        jupyter = Jupyter()
+        jupyter.page = Page(f.strpath)
+        jupyter.page.read()
+        jupyter.enter()
+        output = jupyter.parse()
+        jupyter.exit()
+        return output
+
+    output = convert()
+    assert ">10</code>" in output
+    f.write("```python freeze\nn += 2\nn\n```\n\n```python\nn * 10\n```\n")
+    output = convert()
+    assert output.count('class="cached"') == 2
+    assert ">1</code>" in output
+    assert ">10</code>" in output
+    assert kernels["python"].execute("n")[0]["data"]["text/plain"] == "1"
@@ -0,0 +1,79 @@
+import pytest
+
+from pheasant.core.page import Page
+from pheasant.renderers.jupyter.jupyter import Jupyter
+from pheasant.renderers.jupyter.kernel import kernels
+
+pytest.importorskip("cloudpickle")
+
+
+def test_kernel_checkpoint(tmpdir):
+    kernel = kernels["python"]
+    path = tmpdir.join("checkpoint").strpath
+    kernel.execute("import math\na = 1\ndef f(x):\n    return x + a\n")
+    assert kernel.checkpoint(path)
+    kernel.execute("a = 2\nb = 3")
+    assert kernel.restore(path)
+    outputs = kernel.execute("f(math.floor(1.5)), 'b' in dir()")
+    assert outputs[0]["data"]["text/plain"] == "(2, False)"
+
+
+def test_kernel_checkpoint_unpicklable(tmpdir):
+    kernel = kernels["python"]
+    path = tmpdir.join("checkpoint").strpath
+    kernel.execute("import threading\nlock = threading.Lock()")
+    assert not kernel.checkpoint(path)
+    kernel.execute("del lock")
+
+
+def convert(jupyter, path):
+    jupyter.page = Page(path)
+    jupyter.page.read()
+    jupyter.enter()
+    jupyter.page.source = jupyter.parse()
+    jupyter.exit()
+    return jupyter.page.source
+
+
+def test_jupyter_checkpoint(tmpdir):
+    f = tmpdir.join("example.md")
+    source = "```python\nx = 10\n```\n\n```python\ny = x + 1\n```\n\n"
+    f.write(source + "```python\ny\n```\n")
+    path = f.strpath
+
+    jupyter = Jupyter()
+    jupyter.set_config(checkpoint=True, safe=True)
+    output = convert(jupyter, path)
+    assert "11" in output
+    keys = [cell.key for cell in jupyter.cache]
+    directory = tmpdir.join(".pheasant_cache", "example.md.checkpoints")
+    assert all(directory.join(key).exists() for key in keys)
+
+    kernels.restart()
+    f.write(source + "```python\ny * 2\n```\n")
+    output = convert(jupyter, path)
+    assert "22" in output
+    assert output.count('class="cached"') == 2
+
+
+def test_jupyter_checkpoint_relative_path(tmpdir):
+    f = tmpdir.mkdir("docs").join("p.md")
+    source = "```python\nx = 1\n```\n\n"
+    f.write(source + "```python\nx\n```\n")
+    path = "docs/p.md"
+
+    jupyter = Jupyter()
+    jupyter.set_config(checkpoint=True, safe=True)
+    with tmpdir.as_cwd():
+        jupyter.session = dict(cur_dir="docs")  # The directory of the page.
+        convert(jupyter, path)
+    directory = tmpdir.join("docs", ".pheasant_cache", "p.md.checkpoints")
+    assert len(directory.listdir()) == 2
+    assert not tmpdir.join("docs", "docs").exists()
+
+    kernels.restart()
+    f.write(source + "```python\nx + 1\n```\n")
+    with tmpdir.as_cwd():
+        output = convert(jupyter, path)
+    assert output.count('class="cached"') == 1
+    assert len(directory.listdir()) == 2  # The last checkpoint is replaced.
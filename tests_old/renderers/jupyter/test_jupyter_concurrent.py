@@ -0,0 +1,109 @@
+from pheasant.core.page import Page
+from pheasant.renderers.jupyter.jupyter import Jupyter
+from pheasant.renderers.jupyter.kernel import kernels
+
+
+def test_kernel_submit(tmpdir):
+    kernel = kernels["python"]
+    gate = tmpdir.join("gate")
+    wait = f"import os, time\nwhile not os.path.exists(r'{gate}'):\n time.sleep(0.01)"
+    futures = [kernel.submit(wait)]  # Submitting does not wait for the kernel.
+    futures.extend(kernel.submit(str(k)) for k in range(3))
+    assert not any(future.done() for future in futures)
+    gate.write("")
+    assert futures[0].result() == []
+    outputs = [future.result()[0]["data"]["text/plain"] for future in futures[1:]]
+    assert outputs == ["0", "1", "2"]
+
+
+def test_kernel_submit_after_error():
+    kernel = kernels["python"]
+    futures = [kernel.submit("1/0"), kernel.submit("'next'")]
+    assert futures[0].result()[0]["ename"] == "ZeroDivisionError"
+    assert futures[1].result()[0]["data"]["text/plain"] == "'next'"
+
+
+def test_kernel_submit_postprocess():
+    kernel = kernels["python"]
+
+    def postprocess(outputs, report):
+        return outputs[0]["text"], "total" in report
+
+    assert kernel.submit("print(1)", postprocess=postprocess).result() == ("1", True)
+
+
+source = """
+# Title
+
+```python
+a = 1
+print(a)
+```
+
+Inline {{a + 1}} and {{a + 2}}.
+
+```python hide
+b = a * 10
+```
+
+```python
+b
+```
+"""
+
+
+def convert(jupyter, path):
+    jupyter.page = Page(path)
+    jupyter.page.read()
+    jupyter.enter()
+    jupyter.page.source = jupyter.parser.parse(jupyter.page.source)
+    jupyter.exit()
+    return jupyter.page.source
+
+
+def test_jupyter_concurrent(jupyter, tmpdir):
+    f = tmpdir.join("example.md")
+    f.write(source)
+    jupyter.parser.decorator = None
+    jupyter.set_config(enabled=True, concurrent=False)
+    expected = convert(jupyter, f.strpath)
+    outputs = [cell.output for cell in jupyter.cache]
+    jupyter.page.cache.delete()
+    jupyter.set_config(concurrent=True)
+    try:
+        output = convert(jupyter, f.strpath)
+    finally:
+        jupyter.set_config(concurrent=False)
+    assert "pending" not in output
+    assert output == expected
+    assert [cell.output for cell in jupyter.cache] == outputs
+
+
+def test_jupyter_concurrent_parse(jupyter):
+    jupyter.set_config(concurrent=True)
+    try:
+        output = jupyter.parse("{{3 * 4}} and {{5 * 6}}")
+    finally:
+        jupyter.set_config(concurrent=False)
+    assert output == jupyter.parse("{{3 * 4}} and {{5 * 6}}")
+    assert "30" in output
+
+
+def test_jupyter_concurrent_inspect(jupyter, monkeypatch):
+    kernel = kernels["python"]
+    inspect = kernel.inspect
+    done = []
+
+    def spy(*args):
+        done.extend(future.done() for future in jupyter.pending.values())
+        return inspect(*args)
+
+    monkeypatch.setattr(kernel, "inspect", spy)
+    jupyter.set_config(concurrent=True)
+    try:
+        source = "```python\nimport time\ntime.sleep(0.3)\ndef f():\n    pass\n```\n"
+        output = jupyter.parse(source + "```python inspect\nf\n```\n")
+    finally:
+        jupyter.set_config(concurrent=False)
+    assert done == [True]  # The inspect request waits for the submitted cell.
+    assert "def f():" in output
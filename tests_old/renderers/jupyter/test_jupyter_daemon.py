@@ -0,0 +1,73 @@
+import os
+import threading
+
+import pytest
+
+from pheasant.renderers.jupyter.kernel import (Daemon, Kernel, attach,
+                                               daemon_connection_file, kernels)
+
+
+@pytest.fixture()
+def daemon(tmpdir, monkeypatch):
+    monkeypatch.setenv("JUPYTER_RUNTIME_DIR", tmpdir.strpath)
+    daemon = Daemon([kernels.get_kernel_name("python")])
+    daemon.start()
+    thread = threading.Thread(target=daemon.watch)
+    thread.start()
+    yield daemon
+    daemon.stop()
+    thread.join()
+    daemon.shutdown()
+
+
+def test_attach_without_daemon(tmpdir, monkeypatch):
+    monkeypatch.setenv("JUPYTER_RUNTIME_DIR", tmpdir.strpath)
+    assert attach(kernels.get_kernel_name("python")) is None
+
+
+def test_daemon(daemon):
+    kernel_name = kernels.get_kernel_name("python")
+    assert os.path.exists(daemon_connection_file(kernel_name))
+    kernel = Kernel(kernel_name)
+    kernel.start()
+    assert kernel.attached and kernel.manager is None
+    kernel.execute("import os\na = 1")
+    pid = kernel.evaluate("os.getpid()")
+    kernel.shutdown()
+    assert daemon.managers[kernel_name].is_alive()
+
+    kernel.start()  # The namespace is cleaned up for a new run.
+    assert kernel.evaluate("'a' in dir()") is False
+    assert kernel.execute("import os\nos.getpid()")[0]["data"]["text/plain"] == str(pid)
+
+    kernel.restart()
+    assert kernel.attached
+    assert kernel.execute("import os\nos.getpid()")[0]["data"]["text/plain"] != str(pid)
+    assert kernel.submit("1 + 1").result()[0]["data"]["text/plain"] == "2"
+    kernel.shutdown()
+
+
+def test_daemon_lock(daemon):
+    kernel_name = kernels.get_kernel_name("python")
+    kernel = Kernel(kernel_name)
+    kernel.start()
+    assert kernel.attached
+    assert attach(kernel_name) is None  # In use by the kernel.
+
+    other = Kernel(kernel_name)
+    other.start()
+    assert not other.attached and other.manager
+    other.shutdown()
+
+    kernel.shutdown()
+    client, lock = attach(kernel_name)
+    client.stop_channels()
+    lock.close()
+
+    kernels.attach = False
+    try:
+        kernel.start()
+        assert not kernel.attached and kernel.manager
+    finally:
+        kernels.attach = True
+        kernel.shutdown()
@@ -1,6 +1,10 @@
+import os
+
 import pytest
 
-from pheasant.renderers.jupyter.kernel import kernels, output_hook_factory
+from pheasant.renderers.jupyter.ipython import get_display_priority
+from pheasant.renderers.jupyter.kernel import (kernels, output_hook_factory, pool,
+                                               replay_control, stream_joiner)
 
 
 def test_kernel_names():
@@ -48,6 +52,54 @@ def test_stream_joinner():
     assert outputs[1]["text"] == "3"
 
 
+@pytest.mark.parametrize(
+    "text, expected",
+    [
+        ("abc\x08\x08d", "ad"),
+        ("ab\ncd\x08\x08\x08e", "ab\ne"),
+        ("10%\r20%\r100%\ndone", "100%\ndone"),
+        ("a\r\nb\r", "a\n"),
+        ("ab", "ab"),
+    ],
+)
+def test_replay_control(text, expected):
+    assert replay_control(text) == expected
+
+
+class Text(str):
+    """Stream text which counts how many times it is concatenated."""
+
+    concatenated = 0
+
+    def __add__(self, other):
+        Text.concatenated += 1
+        return str.__add__(self, other)
+
+    def __radd__(self, other):
+        Text.concatenated += 1
+        return str.__add__(other, self)
+
+
+def test_stream_joiner_linear(monkeypatch):
+    replayed = []
+
+    def replay(text):
+        replayed.append(len(text))
+        return replay_control(text)
+
+    monkeypatch.setattr("pheasant.renderers.jupyter.kernel.replay_control", replay)
+    outputs = []
+    for k in range(2000):
+        text = f"\r{k:>8d} it" + "\x08" * 3 + " it/s"
+        outputs.append({"type": "stream", "name": "stderr", "text": Text("log\n")})
+        outputs.append({"type": "stream", "name": "stderr", "text": Text(text)})
+    output = list(stream_joiner(outputs))
+    assert output[0]["text"].endswith(f"log\n{1999:>8d} it/s")
+    # Texts are joined at once and replayed once, instead of one by one.
+    assert Text.concatenated == 0
+    assert replayed == [sum(len(output["text"]) for output in outputs)]
+
+
 def test_kernel():
     kernel_name = kernels.get_kernel_name("python")
     kernel = kernels.get_kernel(kernel_name)
@@ -98,3 +150,118 @@ def test_inspect():
     assert outputs[0]["type"] == "stream"
     assert outputs[0]["name"] == "source"
     assert outputs[0]["text"].startswith('@dataclass')
+
+
+def test_kernel_pool():
+    kernel = kernels["python"]
+    kernel.start()
+    pool.size = 1
+    try:
+        pool.fill(kernel.name, kernel.init_code)
+        spare = pool.spares[kernel.name][0].result()
+        kernel.execute("a = 1")
+        kernel.restart()
+        assert kernel.manager is spare[0]
+        assert kernel.execute("'a' in dir()")[0]["data"]["text/plain"] == "False"
+        code = "import sys\n'pheasant.renderers.jupyter.ipython' in sys.modules"
+        assert kernel.execute(code)[0]["data"]["text/plain"] == "True"
+        spare = pool.spares[kernel.name][0].result()
+        kernel.shutdown()
+        kernel.start()
+        assert kernel.manager is spare[0]
+    finally:
+        pool.size = 0
+        pool.shutdown()
+    assert not pool.spares
+
+
+def test_kernel_setup(tmpdir):
+    kernel = kernels["python"]
+    directory = tmpdir.strpath
+    session = {"cur_dir": directory, "sys_paths": [directory]}
+    kernel.setup(session)
+    assert kernel.evaluate("os.getcwd()") == directory
+    assert kernel.evaluate("sys.path[0]") == directory
+    assert kernel.session == session
+
+    kernel.execute(f"os.chdir(r'{os.getcwd()}')")
+    kernel.setup(session)  # Nothing is sent for the same session.
+    assert kernel.evaluate("os.getcwd()") == os.getcwd()
+
+    kernel.restart()
+    assert kernel.session == {}
+    kernel.setup(session)
+    assert kernel.evaluate("os.getcwd()") == directory
+    kernel.execute(f"sys.path.remove(r'{directory}')\nos.chdir(r'{os.getcwd()}')")
+    kernel.session = {}
+
+
+def test_inspect_single_request(monkeypatch):
+    kernel = kernels["python"]
+    kernel.start()
+    codes = []
+    send = kernel.client.shell_channel.send
+
+    def spy(msg):
+        codes.append(msg["content"]["code"])
+        return send(msg)
+
+    monkeypatch.setattr(kernel.client.shell_channel, "send", spy)
+    outputs = kernel.inspect("def func():\n    return 1\n\nfunc")
+    assert codes == ["def func():\n    return 1\n\nfunc"]
+    assert outputs[0]["text"] == "def func():\n    return 1\n"
+    outputs = kernel.inspect("1/0")
+    assert outputs[0]["ename"] == "ZeroDivisionError"
+
+
+def test_formatter_kwargs(monkeypatch):
+    kernel = kernels["python"]
+    kernel.execute(
+        "from pheasant.renderers.jupyter.ipython import formatter_kwargs\n"
+        "class A:\n    def __repr__(self):\n        return repr(formatter_kwargs)"
+    )
+    codes = []
+    send = kernel.client.shell_channel.send
+
+    def spy(msg):
+        codes.append(msg["content"]["code"])
+        return send(msg)
+
+    monkeypatch.setattr(kernel.client.shell_channel, "send", spy)
+    outputs = kernel.execute("A()", formatter_kwargs="x=1, y='a'")
+    assert outputs[0]["data"]["text/plain"] == "{'x': 1, 'y': 'a'}"
+    assert codes == ["A()"]
+    assert kernel.execute("A()")[0]["data"]["text/plain"] == "{}"
+    outputs = kernel.submit("A()", formatter_kwargs="z=2").result()
+    assert outputs[0]["data"]["text/plain"] == "{'z': 2}"
+    assert kernel.execute("A()")[0]["data"]["text/plain"] == "{}"
+    kernel.execute("del A")
+
+
+def test_display_priority():
+    kernel = kernels["python"]
+    kernel.execute(
+        "calls = []\n"
+        "class B:\n"
+        "    def _repr_html_(self):\n"
+        "        calls.append('html')\n"
+        "        return '<b>b</b>'\n"
+        "    def _repr_latex_(self):\n"
+        "        calls.append('latex')\n"
+        "        return '$b$'"
+    )
+    priority = get_display_priority("")
+    outputs = kernel.execute("B()", display_priority=priority)
+    assert outputs[0]["data"] == {"text/html": "<b>b</b>"}
+    assert kernel.execute("calls")[0]["data"]["text/plain"] == "['html']"
+
+    kernel.execute("calls.clear()")
+    priority = get_display_priority("display-latex")
+    outputs = kernel.submit("B()", display_priority=priority).result()
+    assert outputs[0]["data"] == {"text/latex": "$b$"}
+    assert kernel.execute("calls")[0]["data"]["text/plain"] == "['latex']"
+
+    kernel.execute("calls.clear()")
+    outputs = kernel.execute("B()")
+    assert len(outputs[0]["data"]) == 3
+    kernel.execute("del B, calls")
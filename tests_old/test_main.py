@@ -34,7 +34,7 @@ def test_main_command():
         assert "Aborted" in result.output
         result = runner.invoke(cli, ["clean"], input="y\n")
         assert ".pheasant_cache" in result.output
-        assert "example.md.cache was deleted." in result.output
+        assert "cache.db:example.md was deleted." in result.output
         result = runner.invoke(cli, ["clean", "--yes"])
         assert "No cache found. Aborted." in result.output
 